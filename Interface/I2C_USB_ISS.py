@@ -5,8 +5,10 @@
 #         Import         #
 ##########################
 import time
-# from usb_iss import UsbIss
-from usb_iss import UsbIss
+try:
+    from Interface.capabilities import USB_ISS
+except ImportError:
+    from capabilities import USB_ISS
 
 # Define #
 USB_ISS_Write_delay = 0.01 # SPEC = 80ms in 8 bytes.
@@ -21,6 +23,8 @@ class I2C_ISS(object):
         self.Slave_Addr : Input slave address(8-bit Address).\n
         self.print_debug : Print log = 1; Not to print log = 0; \n
         """
+    capabilities = USB_ISS
+
     def __init__(self, port, print_debug = 0, Slave_Addr = 0xA0, speed = 400):
         # Instance Attribute
         self.port = port
@@ -29,6 +33,8 @@ class I2C_ISS(object):
         self.print_debug = print_debug
         self.speed = speed
 
+        # imported here, only when an USB-ISS is actually used
+        from usb_iss import UsbIss
         self.iss = UsbIss()
         self.iss.open(self.port)
         self.iss.setup_i2c(self.speed)
@@ -46,22 +52,23 @@ class I2C_ISS(object):
         data = [0]*number
         start = 0
         end = 0
+        chunk = self.capabilities.max_read
         while(number > 0):
-            if number < 60:
+            if number < chunk:
                 end += number
                 #if self.print_debug == 1:
                     #print "start = ", start, "end = ", end, "address = ", address, "number = ", number
                 data[start:end] = self.iss.i2c.read(self.Slave_Addr, address, number)
                 break
             else:
-                end += 60
+                end += chunk
                 #if self.print_debug == 1:
                     #print "start = ", start, "end = ", end, "address = ", address, "number = ", number
-                data[start:end] = self.iss.i2c.read(self.Slave_Addr, address, 60)
-                start += 60
-                address += 60
-                if((number - 60) >= 0):
-                    number -= 60
+                data[start:end] = self.iss.i2c.read(self.Slave_Addr, address, chunk)
+                start += chunk
+                address += chunk
+                if((number - chunk) >= 0):
+                    number -= chunk
                 if(address >= 256):
                     address -= 128
         
@@ -74,22 +81,23 @@ class I2C_ISS(object):
         start = 0
         end = 0
         address = 0
+        chunk = self.capabilities.max_read
         while(number > 0):
-            if number < 60:
+            if number < chunk:
                 end += number
                 #if self.print_debug == 1:
                     #print "start = ", start, "end = ", end, "address = ", address, "number = ", number
                 data[start:end] = self.iss.i2c.read_ad0(self.Slave_Addr, number)
                 break
             else:
-                end += 60
+                end += chunk
                 #if self.print_debug == 1:
                     #print "start = ", start, "end = ", end, "address = ", address, "number = ", number
-                data[start:end] = self.iss.i2c.read_ad0(self.Slave_Addr, 60)
-                start += 60
-                address += 60
-                if((number - 60) >= 0):
-                    number -= 60
+                data[start:end] = self.iss.i2c.read_ad0(self.Slave_Addr, chunk)
+                start += chunk
+                address += chunk
+                if((number - chunk) >= 0):
+                    number -= chunk
                 if(address >= 256):
                     address -= 128
         return data
@@ -102,13 +110,14 @@ class I2C_ISS(object):
         byte_shift = 0
         Start_address = byte
         number_of_byte = len(data)
+        chunk = self.capabilities.max_write
         # Modify by Lance
         while(1):
-            if number_of_byte > 60:
-                ret = self.iss.i2c.write(self.Slave_Addr, Start_address, data[(0 + byte_shift):(60 + byte_shift)])
-                Start_address += 60
-                number_of_byte -= 60
-                byte_shift += 60
+            if number_of_byte > chunk:
+                ret = self.iss.i2c.write(self.Slave_Addr, Start_address, data[(0 + byte_shift):(chunk + byte_shift)])
+                Start_address += chunk
+                number_of_byte -= chunk
+                byte_shift += chunk
             else:
                 ret = self.iss.i2c.write(self.Slave_Addr, Start_address, data[byte_shift:(byte_shift + number_of_byte)])
                 break
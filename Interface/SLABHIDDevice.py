@@ -15,47 +15,46 @@
 
 import ctypes
 import sys
+try:
+    from Interface.lazy_dll import LazyDLL
+except ImportError:
+    from lazy_dll import LazyDLL
 
 #-------------------------------------------------------------------------------
-if sys.platform == 'win32':
-    g_DLL = ctypes.windll.LoadLibrary(".\\Interface\\SLABHIDDevice.dll")
-elif sys.platform.startswith('linux'):
-    g_DLL = ctypes.cdll.LoadLibrary("./libslabhiddevice.so.1.0")
-elif sys.platform == 'darwin':
-    g_DLL = ctypes.cdll.LoadLibrary("libSLABHIDDevice.dylib")
-
-fnc = getattr(g_DLL, "HidDevice_GetNumHidDevices")
-fnc.restype = ctypes.c_ulong
-fnc = getattr(g_DLL, "HidDevice_GetHidString")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_Open")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_Close")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_SetFeatureReport_Control")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_GetFeatureReport_Control")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_GetTimeouts")
-fnc.restype = None
-fnc = getattr(g_DLL, "HidDevice_SetTimeouts")
-fnc.restype = None
-fnc = getattr(g_DLL, "HidDevice_GetMaxReportRequest")
-fnc.restype = ctypes.c_ulong
-fnc = getattr(g_DLL, "HidDevice_GetInputReportBufferLength")
-fnc.restype = ctypes.c_ushort
-fnc = getattr(g_DLL, "HidDevice_GetOutputReportBufferLength")
-fnc.restype = ctypes.c_ushort
-fnc = getattr(g_DLL, "HidDevice_GetFeatureReportBufferLength")
-fnc.restype = ctypes.c_ushort
-fnc = getattr(g_DLL, "HidDevice_GetInputReport_Interrupt")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_SetOutputReport_Interrupt")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_GetInputReport_Control")
-fnc.restype = ctypes.c_ubyte
-fnc = getattr(g_DLL, "HidDevice_SetOutputReport_Control")
-fnc.restype = ctypes.c_ubyte
+_RESTYPES = [
+    ("HidDevice_GetNumHidDevices", ctypes.c_ulong),
+    ("HidDevice_GetHidString", ctypes.c_ubyte),
+    ("HidDevice_Open", ctypes.c_ubyte),
+    ("HidDevice_Close", ctypes.c_ubyte),
+    ("HidDevice_SetFeatureReport_Control", ctypes.c_ubyte),
+    ("HidDevice_GetFeatureReport_Control", ctypes.c_ubyte),
+    ("HidDevice_GetTimeouts", None),
+    ("HidDevice_SetTimeouts", None),
+    ("HidDevice_GetMaxReportRequest", ctypes.c_ulong),
+    ("HidDevice_GetInputReportBufferLength", ctypes.c_ushort),
+    ("HidDevice_GetOutputReportBufferLength", ctypes.c_ushort),
+    ("HidDevice_GetFeatureReportBufferLength", ctypes.c_ushort),
+    ("HidDevice_GetInputReport_Interrupt", ctypes.c_ubyte),
+    ("HidDevice_SetOutputReport_Interrupt", ctypes.c_ubyte),
+    ("HidDevice_GetInputReport_Control", ctypes.c_ubyte),
+    ("HidDevice_SetOutputReport_Control", ctypes.c_ubyte),
+]
+
+
+def _load_dll():
+    if sys.platform == 'win32':
+        dll = ctypes.windll.LoadLibrary(".\\Interface\\SLABHIDDevice.dll")
+    elif sys.platform.startswith('linux'):
+        dll = ctypes.cdll.LoadLibrary("./libslabhiddevice.so.1.0")
+    elif sys.platform == 'darwin':
+        dll = ctypes.cdll.LoadLibrary("libSLABHIDDevice.dylib")
+
+    for name, restype in _RESTYPES:
+        getattr(dll, name).restype = restype
+    return dll
+
+
+g_DLL = LazyDLL(_load_dll)
 
 #-------------------------------------------------------------------------------
 # Functions yet to be wrapped
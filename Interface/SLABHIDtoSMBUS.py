@@ -16,6 +16,12 @@ Documentation for the library is provided by CP2112_API_Specification.pdf.
 import ctypes as ct
 import sys
 import time
+try:
+    from Interface.capabilities import CP2112
+    from Interface.lazy_dll import LazyDLL
+except ImportError:
+    from capabilities import CP2112
+    from lazy_dll import LazyDLL
 
 __version__ = "0.0.2"
 __date__ = "27 Aug 2013"
@@ -101,37 +107,42 @@ def hidsmb_errcheck(result, func, args):
 # CP2112 HIDtoSMBus DLL
 #==============================================================================
 
-if sys.platform == 'win32':
-    _DLL = ct.windll.LoadLibrary(".\\Interface\\SLABHIDtoSMBus.dll")
-elif sys.platform.startswith('linux'):
-    _DLL_prev = ct.CDLL("./libslabhiddevice.so.1.0", mode=ct.RTLD_GLOBAL)
-    _DLL = ct.cdll.LoadLibrary("./libslabhidtosmbus.so.1.0")
-elif sys.platform == 'darwin':
-    _DLL = ct.cdll.LoadLibrary("libSLABHIDtoSMBus.dylib")
-
-# for win_function in ["HidSmbus_GetHidGuid", 
-    # "HidSmbus_GetIndexedString", "HidSmbus_GetOpenedIndexedString"]:
-    # fnc = getattr(_DLL, win_function)
-    # fnc.restype = ct.c_int
-    # fnc.errcheck = hidsmb_errcheck
-
-for hidsmb_function in ["HidSmbus_GetNumDevices", 
-    "HidSmbus_GetAttributes", "HidSmbus_GetString", 
-    "HidSmbus_GetLibraryVersion", "HidSmbus_GetHidLibraryVersion", 
-    "HidSmbus_Open", "HidSmbus_Close", 
-    "HidSmbus_IsOpened", "HidSmbus_GetPartNumber", 
-    "HidSmbus_GetOpenedAttributes", "HidSmbus_GetOpenedString", 
-    "HidSmbus_ReadRequest", "HidSmbus_AddressReadRequest", 
-    "HidSmbus_ForceReadResponse", "HidSmbus_WriteRequest", 
-    "HidSmbus_TransferStatusRequest", "HidSmbus_GetTransferStatusResponse", 
-    "HidSmbus_CancelTransfer", "HidSmbus_CancelIo", "HidSmbus_Reset", 
-    "HidSmbus_SetTimeouts", "HidSmbus_GetTimeouts", 
-    "HidSmbus_SetSmbusConfig", "HidSmbus_GetSmbusConfig", 
-    "HidSmbus_SetGpioConfig", "HidSmbus_GetGpioConfig", 
-    "HidSmbus_ReadLatch", "HidSmbus_WriteLatch"]:
-    fnc = getattr(_DLL, hidsmb_function)
-    fnc.restype = ct.c_int
-    fnc.errcheck = hidsmb_errcheck
+def _load_dll():
+    if sys.platform == 'win32':
+        dll = ct.windll.LoadLibrary(".\\Interface\\SLABHIDtoSMBus.dll")
+    elif sys.platform.startswith('linux'):
+        ct.CDLL("./libslabhiddevice.so.1.0", mode=ct.RTLD_GLOBAL)
+        dll = ct.cdll.LoadLibrary("./libslabhidtosmbus.so.1.0")
+    elif sys.platform == 'darwin':
+        dll = ct.cdll.LoadLibrary("libSLABHIDtoSMBus.dylib")
+
+    # for win_function in ["HidSmbus_GetHidGuid", 
+        # "HidSmbus_GetIndexedString", "HidSmbus_GetOpenedIndexedString"]:
+        # fnc = getattr(dll, win_function)
+        # fnc.restype = ct.c_int
+        # fnc.errcheck = hidsmb_errcheck
+
+    for hidsmb_function in ["HidSmbus_GetNumDevices", 
+        "HidSmbus_GetAttributes", "HidSmbus_GetString", 
+        "HidSmbus_GetLibraryVersion", "HidSmbus_GetHidLibraryVersion", 
+        "HidSmbus_Open", "HidSmbus_Close", 
+        "HidSmbus_IsOpened", "HidSmbus_GetPartNumber", 
+        "HidSmbus_GetOpenedAttributes", "HidSmbus_GetOpenedString", 
+        "HidSmbus_ReadRequest", "HidSmbus_AddressReadRequest", 
+        "HidSmbus_ForceReadResponse", "HidSmbus_WriteRequest", 
+        "HidSmbus_TransferStatusRequest", "HidSmbus_GetTransferStatusResponse", 
+        "HidSmbus_CancelTransfer", "HidSmbus_CancelIo", "HidSmbus_Reset", 
+        "HidSmbus_SetTimeouts", "HidSmbus_GetTimeouts", 
+        "HidSmbus_SetSmbusConfig", "HidSmbus_GetSmbusConfig", 
+        "HidSmbus_SetGpioConfig", "HidSmbus_GetGpioConfig", 
+        "HidSmbus_ReadLatch", "HidSmbus_WriteLatch"]:
+        fnc = getattr(dll, hidsmb_function)
+        fnc.restype = ct.c_int
+        fnc.errcheck = hidsmb_errcheck
+    return dll
+
+
+_DLL = LazyDLL(_load_dll)
 
 
 #==============================================================================
@@ -291,11 +302,6 @@ class HidSmbusDevice:
     def AddressReadRequest(self, address=2, count=64, offset_size=2, offset=b'\x00\x00'):
         buf = ct.create_string_buffer(bytes(offset), size=16)
         _DLL.HidSmbus_AddressReadRequest(self.handle, address, count, offset_size, buf)
-        print("step1 type(offset) = ", type(offset))
-        print("step1 len(offset) = ", len(offset))
-        print("step1 bytes(offset) = ", bytes(offset))
-        print("step1 type(bytes(offset)) = ", type(bytes(offset)))
-        print("step1 len(bytes(offset)) = ", len(bytes(offset)))
 
     # HidSmbus_ForceReadResponse(HID_SMBUS_DEVICE device, WORD numBytesToRead);
     def ForceReadResponse(self, count=64):
@@ -307,15 +313,12 @@ class HidSmbusDevice:
         n = ct.c_ulong(0)
         try:
             _DLL.HidSmbus_GetReadResponse(self.handle, ct.byref(self._S0), buf, count, ct.byref(n))
-            print("step3 numBytesRead(Valid) = ", n)
-            print("step3 Status = ", self._S0)
-            print("step3 type(buf.value) = ", type(buf.value))
-            print("step3 len(buf.value) = ", len(buf.value))
         except HidSmbusError as e:
             # Ignore timeout, return the data that was read
             if e.status != 0x12:
                 raise
-        return buf.value
+        # raw, value would stop at the first 0x00 byte
+        return buf.raw[:n.value]
 
     # HidSmbus_WriteRequest(HID_SMBUS_DEVICE device, BYTE slaveAddress, BYTE* buffer, BYTE numBytesToWrite);
     def WriteRequest(self, address, buffer, count=None):
@@ -469,6 +472,8 @@ class I2C_CP2112(object):
         self.Slave_Addr : Input slave address(8-bit Address).\n
         self.print_debug : Print log = 1; Not to print log = 0; \n
         """
+    capabilities = CP2112
+
     def __init__(self, DevIndex = 0, print_debug = 0, slave_addr = 0xA0, speed = 400):
         # Para Init
         self.slave_addr = slave_addr
@@ -481,7 +486,6 @@ class I2C_CP2112(object):
         self.print_debug = print_debug
 
         # Para I2C READ
-        self.MaxbufferSize = 61
         self.addr_size = 1
         
         # Para I2C Write
@@ -499,6 +503,11 @@ class I2C_CP2112(object):
             self.smb.Close()
 
     def I2C_READ(self, address, number):
+        if number > self.capabilities.max_read:
+            # one AddressReadRequest per max_read bytes
+            chunk = self.capabilities.max_read
+            return sum((self.I2C_READ(address + n, min(chunk, number - n)) for n in range(0, number, chunk)), [])
+
         rx_buff = []
         timeout = 0
         # Step 1
@@ -517,23 +526,25 @@ class I2C_CP2112(object):
         if self.autoReadRespond == False:
             print("step2 ForceRead number = ", number)
             self.smb.ForceReadResponse(number)
-        # Step 3
-        while True:
-            rx_buff += self.smb.GetReadResponse()
-            time.sleep(0.05)
-            if(len(rx_buff) >= number):break
-            break
+        # Step 3, the data arrives in reports of up to 61 bytes
+        while len(rx_buff) < number:
+            report = self.smb.GetReadResponse()
+            if not report: break
+            rx_buff += bytearray(report)
 
         if self.print_debug:
             print ("Read byte 0x%02X value = " %address + str.join("", ("0x%02X, " %a for a in rx_buff)))
         return rx_buff
 
     def I2C_WRITE(self, address, data, write_delay = 0):
-        self.write_buffer = []
-        self.write_buffer.append(address)
-        self.write_buffer.extend(data)
-        number = len(self.write_buffer)
-        self.smb.WriteRequest(self.slave_addr, self.write_buffer, number)
+        # the register byte takes one byte of every WriteRequest
+        chunk = self.capabilities.max_write - 1
+        for offset in range(0, max(len(data), 1), chunk):
+            self.write_buffer = []
+            self.write_buffer.append(address + offset)
+            self.write_buffer.extend(data[offset:offset + chunk])
+            number = len(self.write_buffer)
+            self.smb.WriteRequest(self.slave_addr, self.write_buffer, number)
 
     def I2C_PAGE_SELECT(self, page, write_delay = 0):
         data = [0xFF]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+
+class DongleCapabilities(object):
+    """Limits of one I2C dongle, published by its backend.
+
+    max_write/max_read: most bytes after the slave address in one I2C write / read, None if unlimited
+    bit_rates: supported SCL rates in kHz
+    repeated_start: register reads are write + repeated start + read
+    batching: transact() runs several operations in one host<->dongle round-trip
+    latency_ms: inherent cost of one host<->dongle round-trip
+    """
+
+    def __init__(self, max_write=None, max_read=None, bit_rates=(), repeated_start=False, batching=False,
+                 latency_ms=0):
+        self.max_write = max_write
+        self.max_read = max_read
+        self.bit_rates = tuple(bit_rates)
+        self.repeated_start = repeated_start
+        self.batching = batching
+        self.latency_ms = latency_ms
+
+    def __repr__(self):
+        return 'DongleCapabilities(%s)' % ', '.join('%s=%r' % (k, getattr(self, k)) for k in
+                                                    ('max_write', 'max_read', 'bit_rates', 'repeated_start',
+                                                     'batching', 'latency_ms'))
+
+
+# a WriteRequest carries 61 bytes (register byte included), a ReadRequest fetches up to 512 in 61 byte reports
+CP2112 = DongleCapabilities(max_write=61, max_read=512, bit_rates=(10, 100, 400), repeated_start=True,
+                            batching=False, latency_ms=2)
+
+# I2C_AD0/AD1/AD2 commands move at most 60 bytes, the register byte travels in the command
+USB_ISS = DongleCapabilities(max_write=60, max_read=60, bit_rates=(20, 50, 100, 400, 1000), repeated_start=True,
+                             batching=False, latency_ms=1)
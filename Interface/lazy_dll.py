@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+
+class LazyDLL(object):
+    """Loads a vendor library and sets up its prototypes on first use instead of at import."""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._dll = None
+
+    def __getattr__(self, name):
+        if self._dll is None:
+            self._dll = self._loader()
+        return getattr(self._dll, name)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""asyncio variant of the upgrade engine (Python 3.7+).
+
+One event loop drives many upgrades: every wait is an asyncio sleep and
+the blocking vendor calls of the dongles run on a small shared executor.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from fw_upgrade import FirmwareUpgradeBase, StepResult, flatten_steps
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+from i2c_transaction import Transaction
+
+DEFAULT_EXECUTOR_WORKERS = 8
+
+
+class AsyncDongle(object):
+    """Awaitable open_device/close_device/read/write/execute on top of a blocking dongle."""
+
+    executor = None
+
+    def __init__(self, dongle, executor=None):
+        self.dongle = dongle
+        if executor is None:
+            if AsyncDongle.executor is None:
+                AsyncDongle.executor = ThreadPoolExecutor(DEFAULT_EXECUTOR_WORKERS)
+            executor = AsyncDongle.executor
+        self.executor = executor
+
+    def __call(self, func, *args, **kwargs):
+        return asyncio.get_event_loop().run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    @property
+    def capabilities(self):
+        return getattr(self.dongle, 'capabilities', None)
+
+    @property
+    def bus_errors(self):
+        return getattr(self.dongle, 'bus_errors', ())
+
+    async def open_device(self):
+        return await self.__call(self.dongle.open_device)
+
+    async def close_device(self):
+        return await self.__call(self.dongle.close_device)
+
+    async def read(self, addr, reg, count, **kwargs):
+        return await self.__call(self.dongle.read, addr, reg, count, **kwargs)
+
+    async def write(self, addr, reg, data):
+        return await self.__call(self.dongle.write, addr, reg, data)
+
+    async def execute(self, transaction):
+        return await self.__call(transaction.execute, self.dongle)
+
+
+async def run_steps_async(steps, execute, sleep):
+    """run upgrade steps with the coroutines execute(transaction) and sleep(seconds), return their result"""
+    flat = flatten_steps(steps)
+    op = next(flat)
+    while not isinstance(op, StepResult):
+        try:
+            result = await (execute(op) if isinstance(op, Transaction) else sleep(op))
+        except Exception as e:
+            op = flat.throw(e)
+        else:
+            op = flat.send(result)
+    return op.value
+
+
+class AsyncFirmwareUpgrade(FirmwareUpgradeBase):
+    """FirmwareUpgradeBase over an AsyncDongle, run from an event loop.
+
+    The command sequence, file verification, framing, checkpoints, metrics
+    and the retry policy are the upgrade steps of the blocking engine; here
+    their transactions go to the dongle's executor and every wait is an
+    asyncio sleep.  init, end and every method that runs steps (begin,
+    unlock_bootloader, reset, ...) are awaitable.
+    """
+
+    def _run(self, steps):
+        return run_steps_async(steps, self.i2c_dongle.execute, asyncio.sleep)
+
+    async def init(self):
+        await self.i2c_dongle.open_device()
+
+    async def end(self):
+        self.close_frames()
+
+        self.identity_cache.invalidate(self.i2c_dongle)
+        await self.i2c_dongle.close_device()
+
+
+class AsyncDSP_FirmwareUpgrade(AsyncFirmwareUpgrade, DSP_FirmwareUpgrade):
+    """DSP_FirmwareUpgrade run from an event loop."""
+
+
+async def upgrade_all(upgrades, session_timeout=600):
+    """run the upgrades concurrently, return (status, error, seconds) per upgrade"""
+    async def session(upgrade):
+        await upgrade.init()
+        await upgrade.begin()
+
+    async def run(upgrade):
+        start = time.time()
+        try:
+            # a dongle hanging in open_device is contained by the timeout as well
+            await asyncio.wait_for(session(upgrade), session_timeout)
+            return ('SKIPPED' if upgrade.skipped else 'OK', '', time.time() - start)
+        except asyncio.TimeoutError:
+            return ('TIMEOUT', 'no response within %d seconds' % session_timeout, time.time() - start)
+        except Exception as ex:
+            return ('FAIL', str(ex).strip(), time.time() - start)
+        finally:
+            try:
+                await upgrade.end()
+            except Exception:
+                pass
+
+    return await asyncio.gather(*[run(upgrade) for upgrade in upgrades])
+
+
+# ==========================================================================
+# MAIN PROGRAM
+# ==========================================================================
+if __name__ == '__main__':
+    from i2c_dongle import I2C_Dongle_Factory
+
+    parser = argparse.ArgumentParser(
+        description='Upgrade many DSP modules from one event loop, one per I2C dongle')
+
+    parser.add_argument('file', help='the file to be sent')
+    parser.add_argument('-d', '--dongle', dest='dongle',
+                        help=I2C_Dongle_Factory.dongle_help(AsyncDSP_FirmwareUpgrade.min_frame_size()))
+    parser.add_argument('-pwd', '--password', dest='password', default='C24F4F54', type=lambda x: int(x, 16),
+                        help='the password(hex string) of module bootloader protected.')
+    parser.add_argument('--ports', '-p', dest='ports', nargs='+', required=True,
+                        help='the port numbers which I2C dongle devices are attached')
+    parser.add_argument('--workers', dest='workers', type=int, default=DEFAULT_EXECUTOR_WORKERS,
+                        help='threads running the blocking dongle calls')
+    parser.add_argument('--skip-erased', dest='skip_erased', action='store_true',
+                        help='do not send blocks consisting of 0xFF only, flash is already erased.')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='upgrade even when a module already runs this image.')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=600,
+                        help='seconds after which a session is reported as hung')
+
+    args = parser.parse_args()
+
+    _, ext = os.path.splitext(args.file)
+    if ext.lower() not in ('.bin', '.frames'):
+        print("Error: invalid file format")
+        sys.exit()
+
+    executor = ThreadPoolExecutor(args.workers)
+    upgrades = [AsyncDSP_FirmwareUpgrade(AsyncDongle(I2C_Dongle_Factory.create_dongle_object(args.dongle)(port),
+                                                     executor),
+                                         args.file, args.password, verbose=False,
+                                         progress=lambda cur, total: None, skip_erased=args.skip_erased,
+                                         force=args.force)
+                for port in args.ports]
+
+    start = time.time()
+    results = asyncio.run(upgrade_all(upgrades, args.timeout))
+    print('%-12s %-8s %10s %10s %10s  %s' % ('PORT', 'RESULT', 'TIME(s)', 'SKIP(KB)', 'SAVED(s)', 'ERROR'))
+    for port, upgrade, (status, error, seconds) in zip(args.ports, upgrades, results):
+        print('%-12s %-8s %10.1f %10d %10.1f  %s' %
+              (port, status, seconds, upgrade.skipped_bytes // 1024, upgrade.skipped_seconds, error))
+    print('\n%d/%d modules upgraded. [Wall Time: %.1f s]' %
+          (len([r for r in results if r[0] == 'OK']), len(results), time.time() - start))
+    skipped_bytes = sum(upgrade.skipped_bytes for upgrade in upgrades)
+    if skipped_bytes:
+        print('%d bytes of erased blocks not sent, ~%.1f s saved' %
+              (skipped_bytes, sum(upgrade.skipped_seconds for upgrade in upgrades)))
+    skipped = [port for port, r in zip(args.ports, results) if r[0] == 'SKIPPED']
+    if skipped:
+        print('%d modules already current, not upgraded: %s' % (len(skipped), ' '.join(skipped)))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time to convert a DSP .txt image, per-line parsing against the chunked converter.
+
+usage: python -m benchmarks.dsp_convert [image size in KB]
+"""
+
+from __future__ import division, print_function
+import os
+import io
+import sys
+import random
+import shutil
+import struct
+import tempfile
+import timeit
+import importlib
+
+hex_to_bin = importlib.import_module('hex-to-bin_bizlink')
+
+
+def legacy_convert(fin, fout):
+    # the line by line parsing convert_dsp_file_format used to do
+    result = b''
+    total_bytes = 0
+    for hexstr in fin.readlines():
+        hexstr = hexstr.strip()
+
+        if '//' in hexstr:
+            continue
+
+        for h in range(0, 4):
+            b = int(hexstr[6 - h * 2:6 - h * 2 + 2], 16)
+            result += struct.pack('B', b)
+        fout.write(result)
+        total_bytes += len(result)
+        result = b''
+
+    padding = 256 - total_bytes % 256
+    if 0 < padding < 256:
+        fout.write(struct.pack('B', 0xFF) * padding)
+
+
+def make_image(path, size):
+    random.seed(size)
+    with io.open(path, 'w', newline='\n') as f:
+        for n in range(size // 4):
+            if n % 4096 == 0:
+                f.write(u'// section %d\n' % (n // 4096))
+            f.write(u'%08X\n' % random.getrandbits(32))
+
+
+def convert(func, src, dst):
+    with open(src, 'rt') as fin, open(dst, 'wb') as fout:
+        func(fin, fout)
+
+
+def bench(name, func, size, repeat=3):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('%-24s %10.1f ms %10.2f MB/s' % (name, best * 1000, size / best / 1e6))
+    return best
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 4096 * 1024
+    workdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(workdir, 'dsp.txt')
+        make_image(src, size)
+        (legacy_out, chunked_out) = (os.path.join(workdir, 'legacy.bin'), os.path.join(workdir, 'chunked.bin'))
+
+        print('image: %d bytes, %d words' % (size, size // 4))
+        legacy = bench('legacy per-line', lambda: convert(legacy_convert, src, legacy_out), size)
+        chunked = bench('chunked', lambda: convert(hex_to_bin.convert_dsp_file_format, src, chunked_out), size)
+        with open(legacy_out, 'rb') as a, open(chunked_out, 'rb') as b:
+            same = a.read() == b.read()
+        print('\nspeedup: %.1fx, outputs %s' % (legacy / chunked, 'identical' if same else 'DIFFER'))
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Upgrade time and failure probability against an injected fault rate.
+
+usage: python -m benchmarks.fault_recovery [--rates 0 1e-4 1e-3] [--faults nak stale_ack] [--trials 3] [--resume]
+"""
+
+from __future__ import division, print_function
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from bootloader_emulator import BootloaderEmulator, build_image
+from fault_injection import FaultInjectingDongle, FAULTS
+from benchmarks.throughput import run_upgrade
+
+
+def main(args):
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'image.bin')
+    build_image(path, os.urandom(args.size * 1024))
+    try:
+        print('image: %d KB, faults: %s, resume: %s, %d trials per rate' %
+              (args.size, ' '.join(args.faults), args.resume, args.trials))
+        print('%10s %12s %10s %10s  %s' % ('RATE', 'MEAN TIME(s)', 'MAX(s)', 'P(FAIL)', 'INJECTED'))
+        for (index, rate) in enumerate(args.rates):
+            times = []
+            failures = 0
+            injected = dict((fault, 0) for fault in FAULTS)
+            for trial in range(args.trials):
+                emulator = BootloaderEmulator(byte_cost_us=args.byte_cost_us, transaction_ms=args.transaction_ms)
+                dongle = FaultInjectingDongle(emulator, dict((fault, rate / len(args.faults)) for fault in args.faults),
+                                              seed=args.seed + trial)
+                # every trial is a new module, a failed one must not leave it a checkpoint
+                journal_path = os.path.join(workdir, 'trial_%d_%d.journal' % (index, trial))
+                start = time.time()
+                try:
+                    run_upgrade(path, dongle, resume=args.resume, journal_path=journal_path)
+                except Exception:
+                    failures += 1
+                times.append(time.time() - start)
+                for fault, n in dongle.injected.items():
+                    injected[fault] += n
+
+            print('%10g %12.2f %10.2f %10.2f  %s' % (rate, sum(times) / len(times), max(times),
+                                                     failures / args.trials,
+                                                     ' '.join('%s=%d' % (f, injected[f]) for f in args.faults)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Retry and recovery cost under injected faults')
+    parser.add_argument('--rates', nargs='+', type=float, default=[0, 1e-4, 1e-3, 1e-2],
+                        help='total fault probability per transaction')
+    parser.add_argument('--faults', nargs='+', choices=FAULTS, default=['nak'],
+                        help='faults sharing the rate equally')
+    parser.add_argument('--size', type=int, default=32, help='image size in KB')
+    parser.add_argument('--trials', type=int, default=3, help='upgrades per rate')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first trial')
+    parser.add_argument('--resume', action='store_true', help='upgrade in resume mode')
+    parser.add_argument('--byte-cost-us', type=float, default=25,
+                        help='bus cost per byte in microseconds (25 ~ 400 kHz I2C)')
+    parser.add_argument('--transaction-ms', type=float, default=0.5,
+                        help='host<->dongle cost per transaction in milliseconds')
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Per-frame CPU cost of building 0x21 data frames.
+
+usage: python -m benchmarks.frame_encoder [image size in KB]
+
+.bin images are sent through MappedFrames (encoded chunk by chunk from a
+mapping of the file), FrameEncoder frames .frames images once when they
+are written.
+"""
+
+from __future__ import division, print_function
+import os
+import sys
+import math
+import struct
+import timeit
+import tempfile
+
+from frame_stream import FrameEncoder, MappedFrames
+
+
+def legacy_frames(data, buffer_size=256):
+    # the per-block list building send_file_data used to do
+    for trans_num in range(int(math.ceil(len(data) / buffer_size))):
+        filedata = bytearray(data[trans_num * buffer_size: (trans_num + 1) * buffer_size])
+        total_bytes = buffer_size + 4
+        data_out = [0xFF] * total_bytes
+        data_out[0] = 0x21
+        data_out[1:3] = [t for t in bytearray(struct.pack('>H', trans_num + 1))]
+        data_out[3:len(filedata) + 3] = [d for d in filedata]
+        data_out[total_bytes - 1] = sum(data_out[:-1]) & 0xFF
+
+
+def encoder_frames(data, buffer_size=256):
+    frames = FrameEncoder(data, buffer_size)
+    for n in range(frames.count):
+        frames.frame(n)
+
+
+def mapped_frames(path, size, buffer_size=256):
+    frames = MappedFrames(path, 0, size, buffer_size)
+    try:
+        hot_loop(frames)
+    finally:
+        frames.close()
+
+
+def hot_loop(frames):
+    for n in range(frames.count):
+        frames.frame(n)
+
+
+def bench(name, func, count, repeat=5):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('%-28s %10.2f ms %10.2f us/frame' % (name, best * 1000, best * 1e6 / count))
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 512 * 1024
+    data = os.urandom(size)
+    frames = FrameEncoder(data)
+
+    print('image: %d bytes, %d frames' % (size, frames.count))
+    bench('legacy list building', lambda: legacy_frames(data), frames.count)
+    bench('encoder (encode + send)', lambda: encoder_frames(data), frames.count)
+    bench('encoder hot loop only', lambda: hot_loop(frames), frames.count)
+
+    (fd, path) = tempfile.mkstemp(suffix='.bin')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        bench('mapped (encode + send)', lambda: mapped_frames(path, size), frames.count)
+    finally:
+        os.remove(path)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""CLI startup time and the import cost of each dongle backend.
+
+usage: python -m benchmarks.startup [--runs 5]
+
+The CLIs only list the dongle names at startup; a backend's cost below is
+paid once, when that dongle is selected.
+"""
+
+from __future__ import division, print_function
+import sys
+import time
+import argparse
+import subprocess
+
+CLIS = ('dsp_fw_upgrade.py', 'multi_upgrade.py', 'bundle_upgrade.py')
+
+# what selecting each built-in backend imports and binds
+BACKEND_IMPORTS = {
+    'CP2112': 'import Interface.SLABHIDtoSMBUS as m; m._DLL.HidSmbus_GetNumDevices',
+    'ISS': 'import usb_iss'
+}
+
+
+def timed_run(args, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        returncode = subprocess.call(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        times.append(time.time() - start)
+        if returncode != 0:
+            return None
+    return min(times)
+
+
+def main(args):
+    baseline = timed_run([sys.executable, '-c', 'pass'], args.runs)
+    print('interpreter startup: %.1f ms\n' % (baseline * 1000))
+
+    print('%-20s %12s' % ('CLI --help', 'TIME(ms)'))
+    for cli in CLIS:
+        elapsed = timed_run([sys.executable, cli, '--help'], args.runs)
+        print('%-20s %12s' % (cli, '%.1f' % (elapsed * 1000) if elapsed is not None else 'error'))
+
+    print('\n%-20s %12s' % ('backend import', 'TIME(ms)'))
+    for name, statement in sorted(BACKEND_IMPORTS.items()):
+        elapsed = timed_run([sys.executable, '-c', statement], args.runs)
+        print('%-20s %12s' % (name, '%.1f' % ((elapsed - baseline) * 1000) if elapsed is not None else 'unavailable'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CLI startup time with lazily loaded dongle backends')
+    parser.add_argument('--runs', type=int, default=5, help='runs per measurement, the fastest is reported')
+    main(parser.parse_args())
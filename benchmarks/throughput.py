@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""End-to-end upgrade throughput against the bootloader emulator.
+
+Every size is upgraded twice on the same module, the second row (*) is the
+run that finds the image already installed and skips the transfer.
+
+usage: python -m benchmarks.throughput [--sizes 64 256 1024] [--byte-cost-us 25] [--transaction-ms 0.5]
+"""
+
+from __future__ import division, print_function
+import os
+import shutil
+import argparse
+import tempfile
+
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+from bootloader_emulator import BootloaderEmulator, build_image
+
+PHASES = ('verify', 'unlock', 'size_crc', 'check_current', 'backup', 'erase', 'send', 'validate')
+
+
+def run_upgrade(path, dongle, **kwargs):
+    upgrade = DSP_FirmwareUpgrade(dongle, path, verbose=False, progress=lambda cur, total: None, **kwargs)
+    upgrade.init()
+    try:
+        upgrade.begin()
+    finally:
+        upgrade.end()
+    return upgrade.metrics
+
+
+def main(args):
+    workdir = tempfile.mkdtemp()
+    try:
+        print('%8s %8s %8s  %s' % ('SIZE(KB)', 'TOTAL(s)', 'MB/s',
+                                   '  '.join('%*s' % (max(8, len(p)), p) for p in PHASES)))
+        for size_kb in args.sizes:
+            path = os.path.join(workdir, 'image_%d.bin' % size_kb)
+            build_image(path, os.urandom(size_kb * 1024))
+            dongle = BootloaderEmulator(byte_cost_us=args.byte_cost_us, transaction_ms=args.transaction_ms)
+
+            for label in ('%d' % size_kb, '%d*' % size_kb):
+                metrics = run_upgrade(path, dongle)
+                total = metrics.info['total_s']
+                print('%8s %8.2f %8.3f  %s' % (label, total, size_kb / 1024 / total,
+                                               '  '.join('%*.3f' % (max(8, len(p)), metrics.phases.get(p, 0))
+                                                         for p in PHASES)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upgrade throughput against the bootloader emulator')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[64, 256, 1024],
+                        help='image sizes in KB')
+    parser.add_argument('--byte-cost-us', type=float, default=25,
+                        help='bus cost per byte in microseconds (25 ~ 400 kHz I2C)')
+    parser.add_argument('--transaction-ms', type=float, default=0.5,
+                        help='host<->dongle cost per transaction in milliseconds')
+    main(parser.parse_args())
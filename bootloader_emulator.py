@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import time
+import struct
+import binascii
+
+from i2c_transaction import execute_sequential
+from Interface.capabilities import DongleCapabilities
+
+NAK = 0xEE
+
+# typical time (ms) from a bootloader command to its reply being readable
+DEFAULT_LATENCY_MS = {
+    0x10: 20,     # unlock
+    0x11: 1,      # choose image
+    0x12: 1,      # flash addr
+    0x13: 1,      # file size
+    0x14: 1,      # file crc32
+    0x20: 500,    # erase
+    0x21: 1,      # data block
+    0x22: 50,     # validate crc32
+    0x30: 0,      # jump to image
+    0x32: 0,      # reset
+    0x44: 200,    # backup
+    0x74: 1       # module number
+}
+
+
+def build_image(path, payload, module_number='EMULATED', firmware_type_name='DSP', firmware_type=0x84,
+                offset_addr=0, firmware_version=0x0100, build_version=0):
+    """write an upgrade image (64-byte VendorInfo header + payload) as read by FirmwareUpgradeBase"""
+    def to_bytes(s):
+        return s if isinstance(s, bytes) else s.encode('ascii')
+
+    header = struct.pack('>IIIHHI12s32s', len(payload), binascii.crc32(payload) & 0xFFFFFFFF, build_version,
+                         firmware_version, firmware_type, offset_addr, to_bytes(firmware_type_name),
+                         to_bytes(module_number))
+    with open(path, 'wb') as fout:
+        fout.write(header)
+        fout.write(payload)
+
+
+class BootloaderEmulator(object):
+    """Software stand-in for an I2C dongle with one module attached.
+
+    Implements the dongle interface used by FirmwareUpgradeBase
+    (open_device/close_device/read/write) and the module side of the
+    upgrade protocol: the app answering the module number and the
+    bootloader password, and the bootloader commands 0x10-0x14, 0x20-0x22,
+    0x30, 0x32, 0x44 and 0x74.  A reply becomes readable latency_ms[cmd]
+    after its command; until then reads return 0x00.  Every transaction
+    costs transaction_ms plus byte_cost_us per byte on the bus; a batch run
+    through transact() costs transaction_ms once.  Flash contents are kept
+    per image across sessions, so 0x22 reports what an earlier session wrote.
+    """
+
+    def __init__(self, module_number='EMULATED', password=int('C24F4F54', 16), latency_ms=None,
+                 byte_cost_us=25, transaction_ms=0.5, app_addr=0xA0, bootloader_addr=0x36):
+        self.module_number = module_number
+        self.password = list(bytearray(struct.pack('>I', password)))
+        self.latency_ms = dict(DEFAULT_LATENCY_MS)
+        self.latency_ms.update(latency_ms or {})
+        self.byte_cost_us = byte_cost_us
+        self.transaction_ms = transaction_ms
+        self.app_addr = app_addr
+        self.bootloader_addr = bootloader_addr
+
+        self.opened = False
+        self.mode = 'app'
+        self.unlocked = False
+        self.page = 0
+        self.replies = {}
+        self.transactions = 0
+        self.bytes = 0
+        self.batch = False
+        self.images = {}
+        self.capabilities = DongleCapabilities(bit_rates=(100, 400, 1000), repeated_start=True, batching=True,
+                                               latency_ms=transaction_ms)
+        self.__reset_session()
+
+    def __reset_session(self):
+        self.image = None
+        self.image_addr = 0
+        self.file_size = 0
+        self.file_crc32 = 0
+
+    def __bus(self, num_bytes):
+        self.bytes += num_bytes
+        if self.batch:
+            time.sleep(num_bytes * self.byte_cost_us / 1e6)
+        else:
+            self.transactions += 1
+            time.sleep(self.transaction_ms / 1000 + num_bytes * self.byte_cost_us / 1e6)
+
+    def __reply(self, cmd, data):
+        self.replies[cmd] = (time.time() + self.latency_ms.get(cmd, 0) / 1000, list(data))
+
+    @staticmethod
+    def __checksum_ok(data):
+        return sum(data[:-1]) & 0xFF == data[-1]
+
+    def open_device(self):
+        self.opened = True
+
+    def close_device(self):
+        self.opened = False
+
+    def transact(self, ops):
+        self.transactions += 1
+        time.sleep(self.transaction_ms / 1000)
+        self.batch = True
+        try:
+            return execute_sequential(self, ops)
+        finally:
+            self.batch = False
+
+    def write(self, addr, reg, data):
+        data = list(bytearray(data))
+        self.__bus(len(data) + (1 if reg is not None else 0) + 1)
+
+        if addr == self.app_addr:
+            if self.mode != 'app':
+                return 1
+            if reg in (0x7A, 0x7B):
+                self.unlocked = data == self.password
+            elif reg == 0x7F:
+                self.page = data[0]
+            return 0
+
+        if addr != self.bootloader_addr or not data:
+            return 1
+
+        cmd = data[0]
+        if cmd == 0x10:
+            if self.mode == 'bootloader' or self.unlocked:
+                self.mode = 'bootloader'
+                self.__reset_session()
+                self.__reply(cmd, [0x10])
+            return 0
+
+        if self.mode != 'bootloader':
+            return 1
+
+        if cmd == 0x74:
+            self.__reply(cmd, self.__module_number_bytes())
+        elif cmd == 0x11:
+            self.image = data[1]
+            self.__reply(cmd, [cmd])
+        elif cmd in (0x12, 0x13, 0x14):
+            if len(data) != 6 or not self.__checksum_ok(data):
+                self.__reply(cmd, [NAK])
+                return 0
+            value = struct.unpack('>I', bytes(bytearray(data[1:5])))[0]
+            if cmd == 0x12:
+                self.image_addr = value
+            elif cmd == 0x13:
+                self.file_size = value
+            else:
+                self.file_crc32 = value
+            self.__reply(cmd, [cmd])
+        elif cmd == 0x44:
+            self.__reply(cmd, [cmd])
+        elif cmd == 0x20:
+            self.images[self.image] = bytearray(struct.pack('B', 0xFF)) * self.file_size
+            self.__reply(cmd, [cmd])
+        elif cmd == 0x21:
+            self.__reply(cmd, [cmd] if self.__program(data) else [NAK])
+        elif cmd == 0x22:
+            flash = self.images.get(self.image, bytearray(struct.pack('B', 0xFF)) * self.file_size)
+            crc32 = binascii.crc32(bytes(flash[:self.file_size])) & 0xFFFFFFFF
+            self.__reply(cmd, bytearray(struct.pack('>I', crc32)))
+        elif cmd in (0x30, 0x32):
+            self.mode = 'app'
+            self.unlocked = False
+            self.replies = {}
+            self.__reset_session()
+        else:
+            return 1
+        return 0
+
+    def __program(self, data):
+        block_size = len(data) - 4
+        block = data[1] << 8 | data[2]
+        offset = (block - 1) * block_size
+        flash = self.images.get(self.image, bytearray())
+        if block_size <= 0 or block == 0 or not self.__checksum_ok(data) or offset + block_size > len(flash):
+            return False
+        flash[offset: offset + block_size] = bytearray(data[3:-1])
+        return True
+
+    def __module_number_bytes(self):
+        return list(bytearray(self.module_number.encode('ascii').ljust(32, b'\x00')[:32]))
+
+    def read(self, addr, reg, count, cmd=None):
+        self.__bus(count + 1)
+
+        if addr == self.app_addr:
+            if self.mode != 'app':
+                return (0, [])
+            if self.page == 0xF0 and reg == 0xC0:
+                return (count, self.__module_number_bytes()[:count])
+            return (count, [0x00] * count)
+
+        if addr != self.bootloader_addr or cmd not in self.replies:
+            return (0, [])
+
+        (ready, data) = self.replies[cmd]
+        if time.time() < ready:
+            return (count, [0x00] * count)
+        return (min(count, len(data)), data[:count])
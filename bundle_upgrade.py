@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import os
+import json
+import argparse
+from datetime import datetime
+from collections import OrderedDict
+
+from i2c_dongle import I2C_Dongle_Factory
+from fw_upgrade import UpgradeError, upgrade_journal_path
+from multi_upgrade import UPGRADE_CLASSES
+
+
+def load_manifest(path):
+    """ordered [(image path, firmware type name)] of a bundle manifest
+
+    The manifest is a JSON file such as
+        {"images": [{"file": "app.bin", "type": "APP"}, {"file": "dsp.bin", "type": "DSP"}]}
+    with image paths relative to the manifest.
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(path))
+    images = [(os.path.join(root, entry['file']), entry['type'].upper()) for entry in manifest.get('images', [])]
+    if not images:
+        raise UpgradeError('ERROR: bundle manifest %s lists no images.' % path)
+    return images
+
+
+class BundleUpgrade(object):
+    """Upgrade several images of one module in a single bootloader session.
+
+    Every image is verified first, then the bootloader is unlocked once,
+    each image goes through choose image .. validate in manifest order and
+    the module jumps to its image only after the last one.  A failing image
+    resets the module and aborts the bundle.
+    """
+
+    def __init__(self, i2c_dongle, images, password=int('C24F4F54', 16), upgrade_classes=None,
+                 metrics_path=None, journal_tag=None, **kwargs):
+        upgrade_classes = upgrade_classes or UPGRADE_CLASSES
+        self.upgrades = []
+        for path, firmware_type_name in images:
+            if firmware_type_name not in upgrade_classes:
+                raise UpgradeError('ERROR: no upgrade for %s images (%s).' % (firmware_type_name, path))
+            self.upgrades.append(upgrade_classes[firmware_type_name](
+                i2c_dongle, path, password, journal_path=upgrade_journal_path(path, journal_tag), **kwargs))
+        self.metrics_path = metrics_path
+
+    def init(self):
+        self.upgrades[0].init()
+
+    def begin(self):
+        start_time = datetime.now()
+        first = self.upgrades[0]
+        result = 'FAIL'
+
+        try:
+            # the module number is read once, the identity cache serves the other images
+            for upgrade in self.upgrades:
+                upgrade._log("Verifying %s..." % upgrade.file_name)
+                with upgrade.metrics.phase('verify'):
+                    upgrade.verify_file_content()
+
+            first._log("Begin to upgrade %d images..." % len(self.upgrades))
+            with first.metrics.phase('unlock'):
+                first.unlock_bootloader()
+
+            try:
+                for upgrade in self.upgrades:
+                    upgrade._log("\n> Image %s (%s)" % (upgrade.firmware_type_name, upgrade.file_name))
+                    upgrade._internal_begin()
+                    upgrade.metrics.info['result'] = 'SKIPPED' if upgrade.skipped else 'OK'
+            except Exception:
+                first.reset()
+                raise
+
+            last = self.upgrades[-1]
+            with last.metrics.phase('jump'):
+                last.jump_to_image()
+            result = 'OK'
+        finally:
+            if self.metrics_path:
+                self.__dump_metrics(start_time, result)
+
+        first._log("\nBUNDLE UPGRADE FINISHED! [Time Elapse: %s]" % str(datetime.now() - start_time).split('.')[0])
+
+    def __dump_metrics(self, start_time, result):
+        images = []
+        for upgrade in self.upgrades:
+            upgrade.metrics.info['file'] = upgrade.file_name
+            upgrade.metrics.info.setdefault('result', 'FAIL')
+            upgrade.metrics.info['file_size'] = upgrade.file_size
+            images.append(upgrade.metrics.to_dict())
+
+        with open(self.metrics_path, 'w') as f:
+            json.dump(OrderedDict([('result', result), ('start', start_time.isoformat()),
+                                   ('total_s', (datetime.now() - start_time).total_seconds()),
+                                   ('images', images)]), f, indent=2)
+
+    def end(self):
+        for upgrade in self.upgrades[1:]:
+            upgrade.close_frames()
+        self.upgrades[0].end()
+
+
+# ==========================================================================
+# MAIN PROGRAM
+# ==========================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Upgrade all images of a bundle manifest in one bootloader session')
+
+    parser.add_argument(
+        'manifest',
+        help='the JSON manifest listing the images in upgrade order'
+    )
+    parser.add_argument(
+        '-d', '--dongle',
+        dest='dongle',
+        help=I2C_Dongle_Factory.dongle_help(max(c.min_frame_size() for c in UPGRADE_CLASSES.values()))
+    )
+    parser.add_argument(
+        '-pwd', '--password',
+        dest='password',
+        default='C24F4F54',
+        type=lambda x: int(x, 16),
+        help='the password(hex string) of module bootloader protected.'
+    )
+    parser.add_argument(
+        '--port', '-p',
+        dest='port',
+        help='the port number which I2C dongle devices are attached'
+    )
+    parser.add_argument(
+        '--block-size',
+        dest='block_size',
+        type=lambda x: x if x == 'auto' else int(x),
+        help="payload bytes per data frame, or 'auto' to negotiate the largest supported size."
+    )
+    parser.add_argument(
+        '--skip-erased',
+        dest='skip_erased',
+        action='store_true',
+        help='do not send blocks consisting of 0xFF only, flash is already erased.'
+    )
+    parser.add_argument(
+        '--metrics',
+        dest='metrics',
+        help='write per-image phase timings and block latency histograms to this JSON file.'
+    )
+    parser.add_argument(
+        '--force',
+        dest='force',
+        action='store_true',
+        help='upgrade even when the module already runs this image.'
+    )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help='retry failing blocks on their own and resume an interrupted upgrade of the same module.'
+    )
+
+    args = parser.parse_args()
+
+    bundle = None
+    try:
+        dongle = I2C_Dongle_Factory.create_dongle_object(args.dongle)(args.port)
+        bundle = BundleUpgrade(dongle, load_manifest(args.manifest), args.password, resume=args.resume,
+                               journal_tag='%s_%s' % (args.dongle, args.port),
+                               skip_erased=args.skip_erased, block_size=args.block_size,
+                               metrics_path=args.metrics, force=args.force)
+        bundle.init()
+        bundle.begin()
+    except KeyboardInterrupt:
+        pass
+    except Exception as ex:
+        print(ex)
+    finally:
+        if bundle:
+            bundle.end()
@@ -6,20 +6,21 @@ import os
 import argparse
 
 from i2c_dongle import I2C_Dongle_Factory
-from fw_upgrade import FirmwareUpgradeBase
+from fw_upgrade import FirmwareUpgradeBase, upgrade_journal_path
+from fw_library import FirmwareLibrary
 
 class DSP_FirmwareUpgrade(FirmwareUpgradeBase):
     def verify_firmware_type(self, firmware_type_name):
         return firmware_type_name.startswith('DSP')
 
-    def backup_data(self):
-        self._internal_backup_data(0x44, 20)
+    def _backup_data_steps(self):
+        return self._internal_backup_data_steps(0x44, 20)
     
-    def erase_flash(self):
-        self._internal_erase_flash(10)
+    def _erase_flash_steps(self):
+        return self._internal_erase_flash_steps(10)
 
-    def validate_crc32(self):
-        self._internal_validate_crc32(10)
+    def _validate_crc32_steps(self):
+        return self._internal_validate_crc32_steps(10)
 
 # ==========================================================================
 # MAIN PROGRAM
@@ -30,13 +31,12 @@ if __name__ == '__main__':
 
     parser.add_argument(
         'file',
-        help='the file to be sent'
+        help='the file to be sent, or a firmware library directory to pick it from'
     )
     parser.add_argument(
         '-d', '--dongle',
         dest='dongle',
-        help='the usage of communication interface.',
-        choices=I2C_Dongle_Factory.get_dongles()
+        help=I2C_Dongle_Factory.dongle_help(DSP_FirmwareUpgrade.min_frame_size())
     )
     parser.add_argument(
         '-pwd', '--password',
@@ -50,19 +50,58 @@ if __name__ == '__main__':
         dest='port',
         help='the port number which I2C dongle devices are attached'
     )
+    parser.add_argument(
+        '--block-size',
+        dest='block_size',
+        type=lambda x: x if x == 'auto' else int(x),
+        help="payload bytes per data frame, or 'auto' to negotiate the largest supported size."
+    )
+    parser.add_argument(
+        '--skip-erased',
+        dest='skip_erased',
+        action='store_true',
+        help='do not send blocks consisting of 0xFF only, flash is already erased.'
+    )
+    parser.add_argument(
+        '--metrics',
+        dest='metrics',
+        help='write per-phase timings and block latency histogram of the session to this JSON file.'
+    )
+    parser.add_argument(
+        '--library-cache',
+        dest='library_cache',
+        help='the index cache of a firmware library, by default .fw_library.json in the library directory.'
+    )
+    parser.add_argument(
+        '--force',
+        dest='force',
+        action='store_true',
+        help='upgrade even when the module already runs this image.'
+    )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help='retry failing blocks on their own and resume an interrupted upgrade of the same module.'
+    )
 
     args = parser.parse_args()
 
     _, ext = os.path.splitext(args.file)
-    if ext.lower() != '.bin':
+    if not os.path.isdir(args.file) and ext.lower() not in ('.bin', '.frames'):
         print("Error: invalid file format")
         sys.exit()
 
     upgrade = None
     try:
         dongle = I2C_Dongle_Factory.create_dongle_object(args.dongle)(args.port)
-        upgrade = DSP_FirmwareUpgrade(dongle, args.file, args.password)
+        upgrade = DSP_FirmwareUpgrade(dongle, args.file, args.password, resume=args.resume,
+                                      journal_path=upgrade_journal_path(args.file, '%s_%s' % (args.dongle, args.port)),
+                                      skip_erased=args.skip_erased, block_size=args.block_size,
+                                      metrics_path=args.metrics, force=args.force)
         upgrade.init()
+        if os.path.isdir(args.file):
+            upgrade.select_from_library(FirmwareLibrary(args.file, args.library_cache).scan(), 'DSP')
         upgrade.begin()
     except EOFError:
         pass
@@ -71,4 +110,5 @@ if __name__ == '__main__':
     except Exception as ex:
         print(ex)
     finally:
-        upgrade.end()
+        if upgrade:
+            upgrade.end()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import time
+import random
+
+FAULTS = ('nak', 'short_read', 'stale_ack', 'timeout', 'reset')
+
+
+class FaultInjectingDongle(object):
+    """Wrap a dongle and inject faults into its read/write calls.
+
+    rates maps a fault to its probability per transaction:
+        nak        - write is not forwarded and fails (address/data NAK)
+        short_read - read returns fewer bytes than requested
+        stale_ack  - read returns the bytes of the previous read
+        timeout    - call blocks for timeout_s, then fails
+        reset      - write is replaced by a bootloader reset (0x32)
+    Faults are drawn from a RNG seeded with seed, so a run is repeatable.
+    """
+
+    def __init__(self, dongle, rates=None, seed=0, timeout_s=0.1, bootloader_addr=0x36):
+        self.dongle = dongle
+        self.rates = dict((fault, 0) for fault in FAULTS)
+        self.rates.update(rates or {})
+        self.random = random.Random(seed)
+        self.timeout_s = timeout_s
+        self.bootloader_addr = bootloader_addr
+        self.last_read = (0, [])
+        self.injected = dict((fault, 0) for fault in FAULTS)
+
+    def __draw(self, faults):
+        x = self.random.random()
+        for fault in faults:
+            x -= self.rates[fault]
+            if x < 0:
+                self.injected[fault] += 1
+                return fault
+        return None
+
+    @property
+    def capabilities(self):
+        return getattr(self.dongle, 'capabilities', None)
+
+    @property
+    def bus_errors(self):
+        return getattr(self.dongle, 'bus_errors', ())
+
+    def open_device(self):
+        self.dongle.open_device()
+
+    def close_device(self):
+        self.dongle.close_device()
+
+    def write(self, addr, reg, data):
+        fault = self.__draw(('nak', 'timeout', 'reset'))
+        if fault == 'nak':
+            return 1
+        if fault == 'timeout':
+            time.sleep(self.timeout_s)
+            return 1
+        if fault == 'reset':
+            self.dongle.write(self.bootloader_addr, None, [0x32])
+            return 0
+        return self.dongle.write(addr, reg, data)
+
+    def read(self, addr, reg, count, **kwargs):
+        fault = self.__draw(('short_read', 'stale_ack', 'timeout'))
+        if fault == 'timeout':
+            time.sleep(self.timeout_s)
+            return (0, [])
+        if fault == 'stale_ack':
+            return self.last_read
+
+        (n, data) = self.dongle.read(addr, reg, count, **kwargs)
+        if fault == 'short_read' and n:
+            n = self.random.randrange(n)
+            data = data[:n]
+        self.last_read = (n, data)
+        return (n, data)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import mmap
+import math
+import zlib
+import struct
+import string
+import binascii
+
+# magic, format version, block size, frame count, padded file size, crc32 of the padded image,
+# offset addr, firmware type, firmware type name, module number
+HEADER_FORMAT = '>4sHHIIIIH12s32s'
+HEADER_SIZE = 128
+MAGIC = b'FWFS'
+VERSION = 1
+
+
+class FrameEncoder(object):
+    """Encode a whole image into ready-to-send 0x21 data frames.
+
+    All frames are laid out back to back in a single bytearray (0x21,
+    big-endian block number, payload padded with 0xFF, checksum), so that
+    sending a block only hands out a memoryview slice of it.
+    """
+
+    def __init__(self, data, block_size=256):
+        self.block_size = block_size
+        self.frame_size = block_size + 4
+        self.count = int(math.ceil(len(data) / block_size))
+        self.buffer = _encode_frames(data, 0, self.count, block_size)
+        self.view = memoryview(self.buffer)
+
+    def frame(self, n):
+        return self.view[n * self.frame_size: (n + 1) * self.frame_size]
+
+
+def _encode_frames(data, first, count, block_size):
+    # frames of blocks first .. first + count - 1, data holds the payload from block first on
+    frame_size = block_size + 4
+    buffer = bytearray(struct.pack('B', 0xFF)) * (count * frame_size)
+    for n in range(count):
+        offset = n * frame_size
+        block = first + n + 1
+        payload = data[n * block_size: (n + 1) * block_size]
+        buffer[offset] = 0x21
+        struct.pack_into('>H', buffer, offset + 1, block)
+        buffer[offset + 3: offset + 3 + len(payload)] = payload
+        checksum = 0x21 + (block >> 8) + block + _byte_sum(payload) + 0xFF * (block_size - len(payload))
+        buffer[offset + frame_size - 1] = checksum & 0xFF
+    return buffer
+
+
+def _byte_sum(data):
+    # the low half of adler32 is 1 + the byte sum modulo 65521, exact for 256 bytes at a time
+    return sum((zlib.adler32(data[i: i + 256]) & 0xFFFF) - 1 for i in range(0, len(data), 256))
+
+
+class MappedFrames(object):
+    """0x21 data frames built on demand from a read-only mapping of an image file.
+
+    Frames are encoded CHUNK_FRAMES at a time like FrameEncoder does, so
+    sending a block of the current chunk only hands out a slice of it and
+    only one chunk is held in memory.  The payload of size bytes starts at
+    offset in the file and is padded with 0xFF to whole blocks.
+    """
+
+    CHUNK_FRAMES = 256
+
+    def __init__(self, path, offset, size, block_size=256):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < offset + size:
+            self.close()
+            raise Exception('Verify file error: invalid file selected')
+
+        self.offset = offset
+        self.size = size
+        self.block_size = block_size
+        self.frame_size = block_size + 4
+        self.count = int(math.ceil(size / block_size))
+        self.first = 0
+        self.view = memoryview(bytearray())
+
+    def frame(self, n):
+        offset = (n - self.first) * self.frame_size
+        if not 0 <= offset < len(self.view):
+            self.__encode_chunk(n - n % self.CHUNK_FRAMES)
+            offset = (n - self.first) * self.frame_size
+        return self.view[offset: offset + self.frame_size]
+
+    def __encode_chunk(self, first):
+        # a new buffer per chunk, frames handed out earlier stay valid
+        count = min(self.CHUNK_FRAMES, self.count - first)
+        start = self.offset + first * self.block_size
+        data = self.map[start: min(start + count * self.block_size, self.offset + self.size)]
+        self.view = memoryview(_encode_frames(data, first, count, self.block_size))
+        self.first = first
+
+    def close(self):
+        self.map.close()
+
+
+def _to_bytes(s):
+    return s if isinstance(s, bytes) else s.encode('ascii')
+
+
+def printable(data):
+    """keep the printable characters of a byte string or a list of byte values, upper-cased"""
+    if not isinstance(data, str):
+        data = bytearray(data).decode('latin-1')
+    return ''.join(c for c in data if c in string.printable).upper()
+
+
+def write_frame_stream(path, data, firmware_type, firmware_type_name, offset_addr, module_number, block_size=256):
+    """write the pre-framed companion of an image: header followed by all 0x21 frames"""
+    num_padding_bytes = block_size - len(data) % block_size
+    if num_padding_bytes != block_size:
+        data += struct.pack('B', 0xFF) * num_padding_bytes
+
+    frames = FrameEncoder(data, block_size)
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, block_size, frames.count, len(data),
+                         binascii.crc32(data) & 0xFFFFFFFF, offset_addr or 0, firmware_type,
+                         _to_bytes(firmware_type_name), _to_bytes(module_number))
+
+    with open(path, 'wb') as fout:
+        fout.write(header + struct.pack('B', 0x00) * (HEADER_SIZE - len(header)))
+        fout.write(frames.buffer)
+
+
+class FrameStream(object):
+    """Pre-framed image mapped read-only into memory, frames are sent straight from the mapping."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER_SIZE:
+            self.close()
+            raise Exception('Verify file error: invalid frame stream')
+
+        (magic, version, self.block_size, self.count, self.file_size, self.file_crc32, self.offset_addr,
+         self.firmware_type, firmware_type_name, module_number) = \
+            struct.unpack(HEADER_FORMAT, self.map[:struct.calcsize(HEADER_FORMAT)])
+        self.firmware_type_name = printable(firmware_type_name)
+        self.module_number = printable(module_number)
+        self.frame_size = self.block_size + 4
+
+        if magic != MAGIC or version != VERSION or \
+                len(self.map) != HEADER_SIZE + self.count * self.frame_size or \
+                self.file_size != self.count * self.block_size:
+            self.close()
+            raise Exception('Verify file error: invalid frame stream')
+
+        try:
+            self.view = memoryview(self.map)
+        except TypeError:
+            # python 2 mmap has no buffer interface, fall back to slicing the mapping
+            self.view = self.map
+
+    def frame(self, n):
+        offset = HEADER_SIZE + n * self.frame_size
+        return self.view[offset: offset + self.frame_size]
+
+    def close(self):
+        self.view = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # frames still referenced, unmapped once they are released
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import os
+import json
+import argparse
+import tempfile
+
+from fw_upgrade import VendorInfo
+
+CACHE_VERSION = 1
+
+
+class FirmwareLibrary(object):
+    """Index of the upgrade images below a directory tree.
+
+    The 64-byte VendorInfo header of every image is parsed once and kept in
+    a JSON cache keyed by path, mtime and size, so rescanning a share with
+    thousands of images only stats the files.  The cache lives in the
+    library root unless cache_file points elsewhere, e.g. for a read-only
+    share; failing to write it only costs the next scan its speed.
+
+    Images are looked up by module number and firmware type, matched the
+    way the upgrade classes verify it; the highest version wins.
+    """
+
+    def __init__(self, root, cache_file=None):
+        self.root = root
+        self.cache_file = cache_file or os.path.join(root, '.fw_library.json')
+        self.entries = {}
+        self.index = {}
+
+    def __load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if cache.get('version') != CACHE_VERSION:
+            return {}
+        return cache.get('entries', {})
+
+    def __save_cache(self):
+        # written next to the cache and renamed over it, a concurrent scan never reads half a file
+        tmp = None
+        try:
+            (fd, tmp) = tempfile.mkstemp(prefix='.fw_library.', dir=os.path.dirname(os.path.abspath(self.cache_file)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'entries': self.entries}, f, indent=1, sort_keys=True)
+            if hasattr(os, 'replace'):
+                os.replace(tmp, self.cache_file)
+            else:
+                if os.name == 'nt' and os.path.exists(self.cache_file):
+                    os.remove(self.cache_file)
+                os.rename(tmp, self.cache_file)
+        except (IOError, OSError):
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def __parse(path, st):
+        with open(path, 'rb') as f:
+            header = f.read(64)
+        if len(header) != 64:
+            return None
+
+        vendor_info = VendorInfo().unpack(header)
+        if vendor_info.file_size + 64 != st.st_size:
+            return None
+
+        return {'path': path, 'mtime': st.st_mtime, 'size': st.st_size,
+                'module_number': vendor_info.module_number,
+                'firmware_type': vendor_info.firmware_type,
+                'firmware_type_name': vendor_info.firmware_type_name,
+                'firmware_version': vendor_info.firmware_version,
+                'firmware_build_version': vendor_info.firmware_build_version,
+                'file_size': vendor_info.file_size,
+                'file_crc32': vendor_info.file_crc32}
+
+    def scan(self):
+        cached = self.__load_cache()
+        self.entries = {}
+        changed = False
+
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.lower().endswith('.bin'):
+                    continue
+
+                path = os.path.join(dirpath, filename)
+                st = os.stat(path)
+                entry = cached.get(path)
+                if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+                    entry = self.__parse(path, st)
+                    changed = True
+                if entry is not None:
+                    self.entries[path] = entry
+
+        if changed or len(self.entries) != len(cached):
+            self.__save_cache()
+
+        # images of every module, newest first
+        self.index = {}
+        for entry in self.entries.values():
+            self.index.setdefault(entry['module_number'], []).append(entry)
+        for entries in self.index.values():
+            entries.sort(key=lambda e: (e['firmware_version'], e['firmware_build_version'], e['path']), reverse=True)
+        return self
+
+    def lookup(self, module_number, firmware_type):
+        """newest image of the module whose type name starts with firmware_type, or satisfies it if callable"""
+        if not callable(firmware_type):
+            prefix = firmware_type.upper()
+            firmware_type = lambda firmware_type_name: firmware_type_name.startswith(prefix)
+        for entry in self.index.get(module_number.upper(), []):
+            if firmware_type(entry['firmware_type_name']):
+                return entry
+        return None
+
+
+# ==========================================================================
+# MAIN PROGRAM
+# ==========================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Index the upgrade images of a firmware library')
+
+    parser.add_argument(
+        'root',
+        help='the root directory of the firmware library'
+    )
+    parser.add_argument(
+        '--cache',
+        dest='cache',
+        help='the index cache file, by default .fw_library.json in the root directory'
+    )
+
+    args = parser.parse_args()
+
+    library = FirmwareLibrary(args.root, args.cache).scan()
+    print('%-32s %-14s %8s %10s %10s  %s' % ('MODULE', 'TYPE', 'VERSION', 'SIZE', 'CRC32', 'PATH'))
+    for module_number, entries in sorted(library.index.items()):
+        # the newest image of every type
+        listed = set()
+        for entry in entries:
+            if entry['firmware_type_name'] in listed:
+                continue
+            listed.add(entry['firmware_type_name'])
+            print('%-32s %-14s %5d.%02d %10d   %08X  %s' % (module_number, entry['firmware_type_name'],
+                                                           entry['firmware_version'] >> 8,
+                                                           entry['firmware_version'] & 0xFF,
+                                                           entry['file_size'], entry['file_crc32'], entry['path']))
@@ -4,72 +4,360 @@
 # IMPORTS
 # ==========================================================================
 from __future__ import division, with_statement, print_function
+import os
+import re
 import sys
+import json
 import struct
 import math
+import numbers
 import time
-import string
+import random
 import binascii
+import threading
+import types
 from datetime import datetime
-from functools import wraps
-
-
-def retry(ExceptionToCheck=Exception, tries=3, delay=2, backoff=1, logger=None):
-    """Retry calling the decorated function using an exponential backoff.
-    http://www.saltycrane.com/blog/2009/11/trying-out-retry-decorator-python/
-    original from: http://wiki.python.org/moin/PythonDecoratorLibrary#Retry
-    :param ExceptionToCheck: the exception to check. may be a tuple of
-        exceptions to check
-    :type ExceptionToCheck: Exception or tuple
-    :param tries: number of times to try (not retry) before giving up
-    :type tries: int
-    :param delay: initial delay between retries in seconds
-    :type delay: int
-    :param backoff: backoff multiplier e.g. value of 2 will double the delay
-        each retry
-    :type backoff: int
-    :param logger: logger to use. If None, print
-    :type logger: logging.Logger instance
+
+from frame_stream import FrameStream, MappedFrames, printable
+from upgrade_metrics import UpgradeMetrics
+from i2c_transaction import Transaction
+
+
+class UpgradeError(Exception):
+    """Failure of an upgrade step that retrying cannot fix."""
+
+
+class TransientBusError(UpgradeError):
+    """Missed ACK or failed transfer on the bus, usually gone within milliseconds."""
+
+
+class SessionLostError(TransientBusError):
+    """Bootloader no longer in the upgrade session (module reset or left the bootloader)."""
+
+
+class DeviceBusyError(UpgradeError):
+    """Module did not finish a long operation (unlock, backup, erase, validate) in time."""
+
+
+class RetryPolicy(object):
+    """Retry budget and jittered exponential backoff per class of failure.
+
+    schedules maps a failure class to (tries, delay, backoff, max_delay)
+    with delays in seconds; a class with one try fails instantly.
+    Besides TransientBusError only the bus errors a dongle declares (its
+    bus_errors attribute) are transient; a plain UpgradeError and any other
+    exception (a programming error, a journal that cannot be written) is fatal.
+    A SessionLostError is retried after unlocking the bootloader again.
+    """
+
+    DEFAULT_SCHEDULES = {
+        'transient': (5, 0.005, 2, 0.2),
+        'busy': (3, 0.5, 2, 5),
+        'lost': (3, 0.05, 2, 1),
+        'fatal': (1, 0, 1, 0)
+    }
+
+    def __init__(self, schedules=None, jitter=0.5, seed=None):
+        self.schedules = dict(self.DEFAULT_SCHEDULES)
+        self.schedules.update(schedules or {})
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def classify(e, bus_errors=()):
+        if isinstance(e, DeviceBusyError):
+            return 'busy'
+        if isinstance(e, SessionLostError):
+            return 'lost'
+        if isinstance(e, TransientBusError) or (bus_errors and isinstance(e, bus_errors)):
+            return 'transient'
+        return 'fatal'
+
+    def delay(self, failure_class, attempt):
+        """delay (seconds) before retry number attempt, or None once the budget is spent"""
+        (tries, delay, backoff, max_delay) = self.schedules[failure_class]
+        if attempt >= tries:
+            return None
+        delay = min(delay * backoff ** (attempt - 1), max_delay)
+        return delay * (1 - self.jitter * self.random.random())
+
+
+class StepResult(object):
+    """Yielded by an upgrade step to end it with a result."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+def flatten_steps(steps):
+    """Run a tree of upgrade steps, yield only the I/O they ask for.
+
+    An upgrade step is a generator yielding a Transaction to run (it is sent
+    the results), a number of seconds to wait, another step to run first (it
+    is sent that step's result, None if the step ends without a StepResult)
+    or a StepResult ending it.  Exceptions propagate to the calling step;
+    yielding anything else (e.g. the None of a method that ran blocking
+    instead of returning steps) raises UpgradeError in that step.  The
+    flattened generator yields Transactions and waits, takes their results
+    or exceptions back, and finally yields the StepResult of steps.
+    """
+    stack = [steps] if steps is not None else []
+    value = None
+    error = None
+    while stack:
+        (pending, error) = (error, None)
+        try:
+            op = stack[-1].throw(pending) if pending is not None else stack[-1].send(value)
+        except StopIteration:
+            stack.pop()
+            value = None
+            continue
+        except Exception as e:
+            stack.pop()
+            if not stack:
+                raise
+            error = e
+            continue
+
+        value = None
+        if isinstance(op, StepResult):
+            stack.pop().close()
+            value = op.value
+        elif isinstance(op, types.GeneratorType):
+            stack.append(op)
+        elif isinstance(op, (Transaction, numbers.Real)):
+            try:
+                value = yield op
+            except Exception as e:
+                error = e
+        else:
+            error = UpgradeError('ERROR: %r is not an upgrade step.' % (op,))
+    yield StepResult(value)
+
+
+def run_steps(steps, execute, sleep):
+    """run upgrade steps with execute(transaction) and sleep(seconds), return their result"""
+    flat = flatten_steps(steps)
+    op = next(flat)
+    while not isinstance(op, StepResult):
+        try:
+            result = execute(op) if isinstance(op, Transaction) else sleep(op)
+        except Exception as e:
+            op = flat.throw(e)
+        else:
+            op = flat.send(result)
+    return op.value
+
+
+class AckPoller(object):
+    """Adaptive poll schedule for bootloader command responses.
+
+    The first read is issued immediately, then the interval between reads
+    grows from min_interval_ms by backoff up to max_interval_ms.  The
+    turnaround of every command is learned (exponential moving average) so
+    that later polls for the same command sleep through most of the
+    expected latency and then poll tightly around it.
+    :param min_interval_ms: first interval after the immediate read
+    :param max_interval_ms: upper bound of the interval between reads
+    :param backoff: multiplier applied to the interval after each miss
+    :param lead: fraction of the learned turnaround to sleep before polling
+    :param weight: weight of the newest sample in the learned turnaround
+    """
+
+    def __init__(self, min_interval_ms=0.5, max_interval_ms=25, backoff=1.5, lead=0.8, weight=0.25):
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.backoff = backoff
+        self.lead = lead
+        self.weight = weight
+        self.turnaround_ms = {}
+
+    def intervals(self, cmd):
+        """yield the delay (ms) to wait before each successive read"""
+        yield 0
+
+        expected = self.turnaround_ms.get(cmd)
+        if expected and expected * self.lead > self.min_interval_ms:
+            yield expected * self.lead
+
+        interval = self.min_interval_ms
+        while True:
+            yield interval
+            interval = min(interval * self.backoff, self.max_interval_ms)
+
+    def record(self, cmd, elapsed_ms):
+        expected = self.turnaround_ms.get(cmd)
+        if expected is None:
+            self.turnaround_ms[cmd] = elapsed_ms
+        else:
+            self.turnaround_ms[cmd] = expected + self.weight * (elapsed_ms - expected)
+
+
+class ModuleIdentityCache(object):
+    """Mode ('app' or 'bootloader') and module number last reported through each dongle.
+
+    Entries are dropped on reset, jump to image and when the dongle is
+    closed, so back-to-back upgrades on one fixture identify the module once.
     """
 
-    def deco_retry(f):
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, dongle):
+        with self.lock:
+            entry = self.entries.get(id(dongle))
+        if entry is None or entry[0] is not dongle:
+            return None
+        return entry[1:]
+
+    def set(self, dongle, mode, module_number):
+        with self.lock:
+            self.entries[id(dongle)] = (dongle, mode, module_number)
+        return module_number
+
+    def invalidate(self, dongle):
+        with self.lock:
+            self.entries.pop(id(dongle), None)
+
+
+module_identity_cache = ModuleIdentityCache()
+
+
+# journals are kept apart from the images, which may sit on a read-only share
+JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.fw_upgrade', 'journals')
+
+
+def upgrade_journal_path(filename, tag=None):
+    """journal of the upgrade of filename through the dongle tag names, e.g. its port"""
+    name = os.path.basename(filename)
+    if tag is not None:
+        name += '.' + re.sub(r'\W', '_', str(tag))
+    return os.path.join(JOURNAL_DIR, name + '.journal')
+
 
-        @wraps(f)
-        def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
-                try:
-                    return f(*args, **kwargs)
-                except ExceptionToCheck as e:
-                    msg = "%s, Retrying in %d seconds..." % (str(e), mdelay)
-                    if logger:
-                        logger.warning(msg)
-                    else:
-                        print(msg)
-                    time.sleep(mdelay)
-                    mtries -= 1
-                    mdelay *= backoff
-            return f(*args, **kwargs)
+class UpgradeJournal(object):
+    """On-disk checkpoint of the last block acknowledged by the bootloader,
+    so that a crashed process can resume the same module."""
 
-        return f_retry  # true decorator
+    def __init__(self, path):
+        self.path = path
+        self.file = None
 
-    return deco_retry
+    def open(self):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.file = open(self.path, 'w')
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, state):
+        self.open()
+        self.file.seek(0)
+        self.file.truncate()
+        json.dump(state, self.file)
+        self.file.flush()
+
+    def clear(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class FirmwareUpgradeBase(object):
+    """Bootloader upgrade of one image through one dongle.
+
+    Everything that talks to the module is written as upgrade steps (see
+    flatten_steps), so the blocking engine here and the asyncio engine in
+    async_upgrade share one command sequence and only run it differently
+    (_run).  Every command method has a _steps version returning the steps,
+    the public method runs them and returns their result.  Subclasses
+    override the step versions of the hooks (_backup_data_steps,
+    _erase_flash_steps, _validate_crc32_steps); a subclass that still
+    overrides backup_data, erase_flash or validate_crc32 itself gets that
+    method called blocking, as before.
+    """
+
+    CHUNK_SIZE = 1 << 20
+    # payload sizes of a 0x21 frame the bootloader accepts, subclasses for
+    # bootloaders with larger receive buffers extend this
+    DEFAULT_BLOCK_SIZE = 256
+    SUPPORTED_BLOCK_SIZES = (256,)
 
-    def __init__(self, i2c_dongle, filename, password=int('C24F4F54', 16), retry_if_error=True):
+    def __init__(self, i2c_dongle, filename, password=int('C24F4F54', 16), retry_if_error=True,
+                 ack_poller=None, progress=None, verbose=True, resume=False, block_retries=3,
+                 journal_path=None, skip_erased=False, block_size=None, identity_cache=None,
+                 metrics_path=None, retry_policy=None, force=False):
         self.i2c_dongle = i2c_dongle
-        self.buffer_size = 256
+        self.requested_block_size = block_size
+        self.buffer_size = self.negotiate_block_size(block_size)
         self.app_addr = 0xA0
         self.bootloader_addr = 0x36
         self.file_name = filename
-        self.data_to_send = None
         self.file_size = 0
         self.file_crc32 = 0
+        self.frames = None
         self.module_number = ''
         self.password = password
         self.retry = retry_if_error
+        self.ack_poller = ack_poller or AckPoller()
+        self.progress = progress or self.__progressbar
+        self.verbose = verbose
+        self.resume = resume
+        self.block_retries = block_retries
+        self.journal = UpgradeJournal(journal_path or upgrade_journal_path(filename)) if resume else None
+        self.last_acked_block = 0
+        self.skip_erased = skip_erased
+        self.skipped_bytes = 0
+        self.skipped_seconds = 0
+        self.unlock_latency_ms = None
+        self.identity_cache = identity_cache or module_identity_cache
+        self.metrics = UpgradeMetrics()
+        self.metrics_path = metrics_path
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.force = force
+        self.skipped = False
+
+    @property
+    def bus_errors(self):
+        # exceptions the dongle raises for a failed transfer, retried like a missed ACK;
+        # a dongle may know them only once open_device() has loaded its library
+        return tuple(getattr(self.i2c_dongle, 'bus_errors', ()))
+
+    @classmethod
+    def min_frame_size(cls):
+        # the smallest data frame the bootloader takes, a dongle has to write it in one I2C transaction
+        return min(cls.SUPPORTED_BLOCK_SIZES) + 4
+
+    def negotiate_block_size(self, block_size=None):
+        # a data frame (block + 4 bytes) has to fit in one write of the dongle, as published in its capabilities;
+        # None prefers DEFAULT_BLOCK_SIZE, 'auto' the largest size both sides support
+        capabilities = getattr(self.i2c_dongle, 'capabilities', None)
+        max_write = capabilities.max_write if capabilities is not None else None
+        sizes = [b for b in self.SUPPORTED_BLOCK_SIZES if max_write is None or b + 4 <= max_write]
+
+        if block_size is not None and block_size != 'auto' and block_size not in self.SUPPORTED_BLOCK_SIZES:
+            raise UpgradeError("ERROR: block size %d not supported by the bootloader." % block_size)
+        if block_size is not None and block_size != 'auto' and block_size not in sizes:
+            raise UpgradeError("ERROR: block size %d exceeds the %d byte writes of the dongle." % (block_size, max_write))
+        if not sizes:
+            raise UpgradeError("ERROR: the dongle writes at most %d bytes, a data frame needs %d." %
+                               (max_write, self.min_frame_size()))
+
+        if block_size == 'auto':
+            return max(sizes)
+        if block_size is None:
+            return self.DEFAULT_BLOCK_SIZE if self.DEFAULT_BLOCK_SIZE in sizes else max(sizes)
+        return block_size
 
     def init(self):
         # open i2c devices
@@ -87,69 +375,186 @@ class FirmwareUpgradeBase(object):
                          ('=' * int(math.floor(cur * 50 / total)), percent))
         sys.stdout.flush()
 
-    @staticmethod
-    def _wait_ms(milliseconds):
-        time.sleep(milliseconds / 1000)
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
 
-    def _check_cmd(self, addr, expects, timeout_ms=1000, **kwargs):
-        if not isinstance(expects, list):
-            raise TypeError("type for 'response' must be list")
+    def _run(self, steps):
+        # blocking: transactions go straight to the dongle, waits sleep the thread
+        return run_steps(steps, lambda transaction: transaction.execute(self.i2c_dongle), time.sleep)
 
-        kwargs.setdefault('cmd', expects[0])
-        timeout = time.time() + timeout_ms / 1000  # seconds
-        while time.time() < timeout:
-            self._wait_ms(25)
-            (count, data_in) = self.i2c_dongle.read(addr, None, len(expects), **kwargs)
-            if count == len(expects) and data_in == expects:
-                return True
+    def _check_cmd(self, addr, expects, timeout_ms=1000, data_out=None, **kwargs):
+        return self._run(self._check_cmd_steps(addr, expects, timeout_ms, data_out, **kwargs))
+
+    def _check_cmd_steps(self, addr, expects, timeout_ms=1000, data_out=None, **kwargs):
+        (_, reply) = yield self._command_steps(addr, data_out, expects, timeout_ms, **kwargs)
+        yield StepResult(reply is not None)
+
+    def _command_steps(self, addr, data_out, expects, timeout_ms=1000, accept=None, **kwargs):
+        """write data_out (if any) and poll for the expected reply, result (write result, reply)
+
+        The write and the first poll go out as one transaction.  expects is
+        the reply, or its length when accept(reply) decides; reply is None
+        if none was accepted in time.
+        """
+        if accept is None:
+            if not isinstance(expects, list):
+                raise TypeError("type for 'response' must be list")
+            accept = expects.__eq__
         else:
-            return False
+            expects = [None] * expects
+
+        kwargs.setdefault('cmd', expects[0])
+        start = time.time()
+        timeout = start + timeout_ms / 1000  # seconds
+        result = (0, None)
+        for delay_ms in self.ack_poller.intervals(kwargs['cmd']):
+            if delay_ms:
+                yield delay_ms / 1000
+            transaction = Transaction()
+            if data_out is not None:
+                transaction.write(addr, None, data_out)
+            results = yield transaction.read(addr, None, len(expects), **kwargs)
+            if data_out is not None:
+                data_out = None
+                if results[0] != 0:
+                    result = (results[0], None)
+                    break
+                # learn the turnaround from the end of the write, the bus time of the batch is not latency
+                start = time.time()
+
+            (count, data_in) = results[-1]
+            if count == len(expects) and accept(data_in):
+                self.ack_poller.record(kwargs['cmd'], (time.time() - start) * 1000)
+                result = (0, data_in)
+                break
+            if time.time() >= timeout:
+                break
+        yield StepResult(result)
 
     def verify_file_content(self):
+        return self._run(self._verify_file_content_steps())
+
+    def _verify_file_content_steps(self):
+        if self.file_name.lower().endswith('.frames'):
+            yield self._verify_frame_stream_steps()
+            return
+
         vendor_info = VendorInfo()
-        fw_data = None
 
         with open(self.file_name, 'rb') as file:
             vendor_info_data = file.read(64)
             if len(vendor_info_data) == 0:
-                raise Exception("Verify file error: empty file")
+                raise UpgradeError("Verify file error: empty file")
 
             vendor_info.unpack(vendor_info_data)
 
-            file.seek(64)
-            fw_data = file.read()
+            (file_crc32, padded_crc32) = self.__payload_crc32(file, vendor_info.file_size)
 
-        if not fw_data or vendor_info.file_size != len(fw_data) or \
-                vendor_info.file_crc32 != binascii.crc32(fw_data) & 0xFFFFFFFF:
-            raise Exception('Verify file error: invalid file selected')
+        if not vendor_info.file_size or file_crc32 is None or vendor_info.file_crc32 != file_crc32:
+            raise UpgradeError('Verify file error: invalid file selected')
 
         if not self.verify_firmware_type(vendor_info.firmware_type_name) or \
-                not self.verify_module_number(vendor_info.module_number):
-            raise Exception('Verify file error: invalid file selected')
+                not (yield self._verify_module_number_steps(vendor_info.module_number)):
+            raise UpgradeError('Verify file error: invalid file selected')
 
         # print('Upgrade info: %s %s v%s' % (vendor_info.module_number, vendor_info.firmware_type_name, self.__to_version_str(vendor_info.firmware_version)))
 
-        self.prepare_upgrading(fw_data, vendor_info.firmware_type, vendor_info.firmware_type_name,
+        frames = MappedFrames(self.file_name, len(vendor_info_data), vendor_info.file_size, self.buffer_size)
+        self.prepare_upgrading(frames, vendor_info.firmware_type, vendor_info.firmware_type_name,
                                vendor_info.offset_addr, vendor_info.module_number)
+        self.file_size = frames.count * self.buffer_size
+        self.file_crc32 = padded_crc32
+
+    def __payload_crc32(self, file, size):
+        # CRC of the payload and of the image padded with 0xFF to whole blocks, read chunk by chunk;
+        # the frames are built from a mapping of the file when they are sent
+        if os.fstat(file.fileno()).st_size - file.tell() != size:
+            return (None, None)
+
+        chunk = bytearray(min(self.CHUNK_SIZE, size))
+        view = memoryview(chunk)
+        crc32 = 0
+        pos = 0
+        while pos < size:
+            count = file.readinto(view[:min(len(chunk), size - pos)])
+            if not count:
+                return (None, None)
+            crc32 = binascii.crc32(view[:count], crc32)
+            pos += count
+
+        padding = struct.pack('B', 0xFF) * (-size % self.buffer_size)
+        return (crc32 & 0xFFFFFFFF, binascii.crc32(padding, crc32) & 0xFFFFFFFF)
+
+    def verify_frame_stream(self):
+        return self._run(self._verify_frame_stream_steps())
+
+    def _verify_frame_stream_steps(self):
+        # pre-framed image produced by hex-to-bin_bizlink.py, nothing left to pad, CRC or frame;
+        # its block size has to pass the same checks as a requested one
+        stream = FrameStream(self.file_name)
+        try:
+            if self.requested_block_size not in (None, 'auto', stream.block_size):
+                raise UpgradeError("ERROR: %s is framed in %d byte blocks, not %d." %
+                                   (self.file_name, stream.block_size, self.requested_block_size))
+            block_size = self.negotiate_block_size(stream.block_size)
+            if not self.verify_firmware_type(stream.firmware_type_name) or \
+                    not (yield self._verify_module_number_steps(stream.module_number)):
+                raise UpgradeError('Verify file error: invalid file selected')
+        except Exception:
+            stream.close()
+            raise
+
+        self.prepare_upgrading(stream, stream.firmware_type, stream.firmware_type_name,
+                               stream.offset_addr, stream.module_number)
+        self.buffer_size = block_size
+        self.file_size = stream.file_size
+        self.file_crc32 = stream.file_crc32
 
     def verify_firmware_type(self, firmware_type_name):
         return False
 
     def verify_module_number(self, module_number):
+        return self._run(self._verify_module_number_steps(module_number))
+
+    def _verify_module_number_steps(self, module_number):
+        read = yield self._read_module_number_steps(module_number)
+        yield StepResult(read == module_number)
+
+    def read_module_number(self, module_number=''):
+        return self._run(self._read_module_number_steps(module_number))
+
+    def _read_module_number_steps(self, module_number=''):
+        identity = self.identity_cache.get(self.i2c_dongle)
+        if identity:
+            yield StepResult(identity[1])
+            return
+
         timeout = time.time() + 20000 / 1000  # seconds
         while time.time() < timeout:
-            (count, data_in) = self.__verify_module_number_app(module_number)
+            (count, data_in) = (yield self.__verify_module_number_app(module_number))[-1]
             if count != 0 and data_in != [0xFF] * count and data_in != [0x00] * count:
-                return filter(lambda x: x in set(string.printable),
-                              ''.join([chr(d) for d in data_in])).upper() == module_number
+                yield StepResult(self.identity_cache.set(self.i2c_dongle, 'app', printable(data_in)))
+                return
 
-            (count, data_in) = self.__verify_module_number_bootloader()
+            (count, data_in) = (yield self.__verify_module_number_bootloader())[-1]
             if count != 0 and data_in != [0xFF] * count and data_in != [0x00] * count:
-                return filter(lambda x: x in set(string.printable),
-                              ''.join([chr(d) for d in data_in])).upper() == module_number
+                yield StepResult(self.identity_cache.set(self.i2c_dongle, 'bootloader', printable(data_in)))
+                return
 
-            self._wait_ms(1000)
-        raise Exception('ERROR: verify file timeout.')
+            yield 1
+        raise DeviceBusyError('ERROR: verify file timeout.')
+
+    def select_from_library(self, library, firmware_type_name):
+        return self._run(self._select_from_library_steps(library, firmware_type_name))
+
+    def _select_from_library_steps(self, library, firmware_type_name):
+        # pick the image matching the attached module from an indexed firmware library
+        module_number = yield self._read_module_number_steps()
+        entry = library.lookup(module_number, self.verify_firmware_type)
+        if entry is None:
+            raise UpgradeError('ERROR: no %s image for module %s in library.' % (firmware_type_name, module_number))
+        self.file_name = entry['path']
 
     def __verify_module_number_app(self, module_number):
         if module_number.find('100G') != -1 or module_number.find('50G') != -1:  # 100G/50G
@@ -157,218 +562,435 @@ class FirmwareUpgradeBase(object):
         else:
             reg_addr = 0x7A
         password = [0xC1, 0x4D, 0x41, 0x5A]
-        self.i2c_dongle.write(self.app_addr, reg_addr, password)
 
-        # select page FOh
-        data_out = [0xF0]
-        self.i2c_dongle.write(self.app_addr, 0x7F, data_out)
-
-        # read 32 bytes module number and check
-        (count, data_in) = self.i2c_dongle.read(self.app_addr, 0xC0, 32)
-        return (count, data_in)
+        # select page FOh, read 32 bytes module number and check
+        return Transaction().write(self.app_addr, reg_addr, password) \
+            .write(self.app_addr, 0x7F, [0xF0]) \
+            .read(self.app_addr, 0xC0, 32)
 
     def __verify_module_number_bootloader(self):
         # read 32 bytes module number and check
-        self.i2c_dongle.write(self.bootloader_addr, None, [0x74])
-        self._wait_ms(40)
-        (count, data_in) = self.i2c_dongle.read(self.bootloader_addr, None, 32, cmd=0x74)
-        return (count, data_in)
+        return Transaction().write(self.bootloader_addr, None, [0x74]).delay(40) \
+            .read(self.bootloader_addr, None, 32, cmd=0x74)
 
-    def prepare_upgrading(self, file_data, firmware_type, firmware_type_name, offset_addr, module_number):
-        self.data_to_send = file_data
+    def prepare_upgrading(self, frames, firmware_type, firmware_type_name, offset_addr, module_number):
+        self.close_frames()
+        self.file_size = 0
+        self.file_crc32 = 0
+        self.frames = frames
         self.image = firmware_type & 0xFF
         self.image_addr = offset_addr
         self.firmware_type_name = firmware_type_name
         self.module_number = module_number
 
-    def calc_file_size_crc(self):
-        # try to pad 0xFF
-        num_padding_bytes = self.buffer_size - len(self.data_to_send) % self.buffer_size
-        if num_padding_bytes != self.buffer_size:
-            self.data_to_send += struct.pack('B', 0xFF) * num_padding_bytes
-
-        self.file_size = len(self.data_to_send)
-        self.file_crc32 = binascii.crc32(self.data_to_send) & 0xFFFFFFFF
-
-    def send_file_data(self):
-        # send file blocks
-        trans_num = 0
+    def close_frames(self):
+        # unmap the image, if its frames were built from a mapping of the file
+        if self.frames is not None and hasattr(self.frames, 'close'):
+            self.frames.close()
+        self.frames = None
+
+    def send_file_data(self, start_block=0):
+        return self._run(self._send_file_data_steps(start_block))
+
+    def _send_file_data_steps(self, start_block=0):
+        # send file blocks, a failing block is retried on its own in resume mode
+        retries = self.block_retries if self.resume else 0
+        erased_blocks = self.find_erased_blocks() if self.skip_erased else set()
+        sent_blocks = 0
+        start_time = time.time()
+        trans_num = start_block
         max_trans_num = math.ceil(self.file_size / self.buffer_size)
         while trans_num < max_trans_num:
-            filedata = self.data_to_send[trans_num * self.buffer_size: (trans_num + 1) * self.buffer_size]
+            if trans_num in erased_blocks:
+                # flash is already 0xFF after erase_flash, nothing to program
+                trans_num = trans_num + 1
+                self.checkpoint(trans_num)
+                self.progress(trans_num, max_trans_num)
+                continue
 
             # Write the data to the bus
-            total_bytes = self.buffer_size + 4
-            data_out = [0xFF] * total_bytes
-            data_out[0] = 0x21
-            data_out[1:3] = [ord(t) for t in struct.pack('>H', trans_num + 1)]
-            data_out[3:len(filedata) + 3] = [ord(d) for d in filedata]
-            checksum = sum(data_out[:-1]) & 0xFF
-            data_out[total_bytes - 1] = checksum
-
-            res = self.i2c_dongle.write(self.bootloader_addr, None, data_out)
+            data_out = self.frames.frame(trans_num)
 
-            if res != 0:
-                raise Exception("\nerror: write data error")
+            block_start = time.time()
+            for _ in range(retries + 1):
+                (res, reply) = yield self._command_steps(self.bootloader_addr, data_out, [0x21], 100)
+                if reply is not None:
+                    break
+            else:
+                if res != 0:
+                    raise TransientBusError("\nerror: write data error")
+                raise TransientBusError("\nerror: ACK error")
+            self.metrics.block_latency.add(time.time() - block_start)
 
             trans_num = trans_num + 1
-
-            self.__progressbar(trans_num, max_trans_num)
-
-            if not self._check_cmd(self.bootloader_addr, [0x21], 100):
-                raise Exception("\nerror: ACK error")
+            sent_blocks = sent_blocks + 1
+            self.checkpoint(trans_num)
+
+            self.progress(trans_num, max_trans_num)
+
+        if erased_blocks:
+            skipped = len([b for b in erased_blocks if b >= start_block])
+            self.skipped_bytes = skipped * self.buffer_size
+            if sent_blocks:
+                self.skipped_seconds = skipped * (time.time() - start_time) / sent_blocks
+            self.metrics.info['skipped_bytes'] = self.skipped_bytes
+            self.metrics.info['skipped_seconds'] = self.skipped_seconds
+            self._log("\n> Skipped %d erased blocks (%d bytes, ~%.1f seconds saved)" %
+                      (skipped, self.skipped_bytes, self.skipped_seconds))
+
+    def find_erased_blocks(self):
+        # blocks consisting of 0xFF only, i.e. identical to erased flash
+        erased = struct.pack('B', 0xFF) * self.buffer_size
+        return set(n for n in range(self.frames.count) if self.frames.frame(n)[3:-1] == erased)
+
+    def checkpoint(self, block):
+        self.last_acked_block = block
+        if self.journal:
+            try:
+                self.journal.save(self.__journal_state(block))
+            except (IOError, OSError) as e:
+                self.__drop_journal(e)
+
+    def __drop_journal(self, e):
+        # without the journal only resuming after a crash is lost, not the upgrade
+        self._log("\n> Journal %s not writable (%s), resuming after a crash disabled." % (self.journal.path, e))
+        self.journal = None
+
+    def __journal_state(self, block):
+        return {'module_number': self.module_number, 'image': self.image, 'image_addr': self.image_addr,
+                'file_size': self.file_size, 'file_crc32': self.file_crc32, 'block': block}
+
+    def _resume_block(self):
+        if not self.resume:
+            return 0
+        if self.last_acked_block or not self.journal:
+            return self.last_acked_block
+
+        state = self.journal.load()
+        if state and state == self.__journal_state(state.get('block')):
+            self.last_acked_block = state['block']
+        return self.last_acked_block
+
+    def __open_journal(self):
+        # checked before the erase rather than at the first checkpoint after it
+        if self.journal:
+            try:
+                self.journal.open()
+            except (IOError, OSError) as e:
+                self.__drop_journal(e)
+
+    def _forget_checkpoint(self):
+        self.last_acked_block = 0
+        if self.journal:
+            try:
+                self.journal.clear()
+            except (IOError, OSError) as e:
+                self.__drop_journal(e)
 
     def send_total_file_size(self):
+        return self._run(self._send_total_file_size_steps())
+
+    def _send_total_file_size_steps(self):
         data_out = [0] * 6
         data_out[0] = 0x13
-        data_out[1:5] = [ord(d) for d in struct.pack('>I', self.file_size)]
+        data_out[1:5] = list(bytearray(struct.pack('>I', self.file_size)))
         data_out[5] = sum(data_out) & 0xFF
 
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
-        if not self._check_cmd(self.bootloader_addr, [0x13]):
-            raise Exception("ERROR: send file length error.")
+        if not (yield self._check_cmd_steps(self.bootloader_addr, [0x13], data_out=data_out)):
+            raise TransientBusError("ERROR: send file length error.")
 
     def send_file_crc32(self):
+        return self._run(self._send_file_crc32_steps())
+
+    def _send_file_crc32_steps(self):
         data_out = [0] * 6
         data_out[0] = 0x14
-        data_out[1:5] = [ord(d) for d in struct.pack('>I', self.file_crc32)]
+        data_out[1:5] = list(bytearray(struct.pack('>I', self.file_crc32)))
         data_out[5] = sum(data_out) & 0xFF
 
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
-        if not self._check_cmd(self.bootloader_addr, [0x14]):
-            raise Exception("ERROR: send file crc32 error.")
+        if not (yield self._check_cmd_steps(self.bootloader_addr, [0x14], data_out=data_out)):
+            raise TransientBusError("ERROR: send file crc32 error.")
 
     def unlock_bootloader(self):
-        timeout = time.time() + 20000 / 1000  # seconds
-        while time.time() < timeout:
-            if self.module_number.find('100G') != -1 or self.module_number.find('50G') != -1:  # 100G/50G
-                reg_addr = 0x7B
-            else:
-                reg_addr = 0x7A
-            password = [ord(d) for d in struct.pack('>I', self.password)]
-            self.i2c_dongle.write(self.app_addr, reg_addr, password)
+        return self._run(self._unlock_bootloader_steps())
 
-            self._wait_ms(10)
+    def _unlock_bootloader_steps(self):
+        # no app left to take the password when the module is known to sit in its bootloader
+        identity = self.identity_cache.get(self.i2c_dongle)
+        in_bootloader = identity is not None and identity[0] == 'bootloader'
 
+        timeout = time.time() + 20000 / 1000  # seconds
+        while time.time() < timeout:
+            if not in_bootloader:
+                if self.module_number.find('100G') != -1 or self.module_number.find('50G') != -1:  # 100G/50G
+                    reg_addr = 0x7B
+                else:
+                    reg_addr = 0x7A
+                password = list(bytearray(struct.pack('>I', self.password)))
+                yield Transaction().write(self.app_addr, reg_addr, password)
+
+                yield 0.01
+            in_bootloader = False
+
+            # poll the 0x10 reply from the moment "BOOT" is sent instead of sleeping 500 ms
             data_out = [0x10, 0x42, 0x4F, 0x4F, 0x54]
-            self.i2c_dongle.write(self.bootloader_addr, None, data_out)
-            self._wait_ms(500)
-            (count, data_in) = self.i2c_dongle.read(self.bootloader_addr, None, 1, cmd=0x10)
-            if count == 1 and data_in[0] == 0x10:
+            start = time.time()
+            if (yield self._check_cmd_steps(self.bootloader_addr, [0x10], 500, data_out=data_out)):
+                self.unlock_latency_ms = (time.time() - start) * 1000
+                self._log("> Bootloader unlocked in %.1f ms" % self.unlock_latency_ms)
+                if identity is not None:
+                    self.identity_cache.set(self.i2c_dongle, 'bootloader', identity[1])
                 break
         else:
-            raise Exception("ERROR: bootloader unlock error.")
+            raise DeviceBusyError("ERROR: bootloader unlock error.")
 
     def choose_image_to_upgrade(self):
+        return self._run(self._choose_image_to_upgrade_steps())
+
+    def _choose_image_to_upgrade_steps(self):
         data_out = [0x11, self.image]
 
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
-        if not self._check_cmd(self.bootloader_addr, [0x11]):
-            raise Exception("ERROR: choose image to upgrade error.")
+        if not (yield self._check_cmd_steps(self.bootloader_addr, [0x11], data_out=data_out)):
+            # a bootloader that no longer answers the module number read has been left or reset
+            (count, data_in) = (yield self.__verify_module_number_bootloader())[-1]
+            if not count or all(b in (0x00, 0xFF) for b in data_in):
+                raise SessionLostError("ERROR: bootloader session lost.")
+            raise TransientBusError("ERROR: choose image to upgrade error.")
 
     def flash_addr(self):
+        return self._run(self._flash_addr_steps())
+
+    def _flash_addr_steps(self):
         data_out = [0] * 6
         data_out[0] = 0x12
-        data_out[1:5] = [ord(d) for d in struct.pack('>I', self.image_addr)]
+        data_out[1:5] = list(bytearray(struct.pack('>I', self.image_addr)))
         data_out[5] = sum(data_out) & 0xFF
 
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
-        if not self._check_cmd(self.bootloader_addr, [0x12]):
-            raise Exception("ERROR: flash addr error.")
+        if not (yield self._check_cmd_steps(self.bootloader_addr, [0x12], data_out=data_out)):
+            raise TransientBusError("ERROR: flash addr error.")
 
     def backup_data(self):
-        pass
+        return self._run(self._backup_data_steps())
+
+    def _backup_data_steps(self):
+        # no backup unless a subclass asks for one
+        return
+        yield
 
     def _internal_backup_data(self, command, wait_seconds=5):
-        data_out = [command]
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
+        return self._run(self._internal_backup_data_steps(command, wait_seconds))
 
-        if not self._check_cmd(self.bootloader_addr, [command], wait_seconds * 1000):
-            raise Exception("ERROR: backup data error.")
+    def _internal_backup_data_steps(self, command, wait_seconds=5):
+        data_out = [command]
+        if not (yield self._check_cmd_steps(self.bootloader_addr, [command], wait_seconds * 1000, data_out=data_out)):
+            raise DeviceBusyError("ERROR: backup data error.")
 
     def erase_flash(self):
-        self._internal_erase_flash()
+        return self._run(self._erase_flash_steps())
+
+    def _erase_flash_steps(self):
+        return self._internal_erase_flash_steps()
 
     def _internal_erase_flash(self, wait_seconds=10):
-        data_out = [0x20]
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
+        return self._run(self._internal_erase_flash_steps(wait_seconds))
 
-        if not self._check_cmd(self.bootloader_addr, [0x20], wait_seconds * 1000):
-            raise Exception("ERROR: erase flash error.")
+    def _internal_erase_flash_steps(self, wait_seconds=10):
+        data_out = [0x20]
+        if not (yield self._check_cmd_steps(self.bootloader_addr, [0x20], wait_seconds * 1000, data_out=data_out)):
+            raise DeviceBusyError("ERROR: erase flash error.")
 
     def validate_crc32(self):
-        self._internal_validate_crc32()
+        return self._run(self._validate_crc32_steps())
+
+    def _validate_crc32_steps(self):
+        return self._internal_validate_crc32_steps()
 
     def _internal_validate_crc32(self, wait_seconds=5):
-        data_out = [0x22]
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
+        return self._run(self._internal_validate_crc32_steps(wait_seconds))
 
-        if not self._check_cmd(self.bootloader_addr,
-                               [ord(x) for x in struct.pack('>I', self.file_crc32)],
-                               wait_seconds * 1000, cmd=0x22):
-            raise Exception("ERROR: validate CRC error.")
+    def _internal_validate_crc32_steps(self, wait_seconds=5):
+        data_out = [0x22]
+        if not (yield self._check_cmd_steps(self.bootloader_addr,
+                                            list(bytearray(struct.pack('>I', self.file_crc32))),
+                                            wait_seconds * 1000, cmd=0x22, data_out=data_out)):
+            raise DeviceBusyError("ERROR: validate CRC error.")
+
+    def read_flash_crc32(self, wait_seconds=10):
+        return self._run(self._read_flash_crc32_steps(wait_seconds))
+
+    def _read_flash_crc32_steps(self, wait_seconds=10):
+        # CRC32 the bootloader computes over file_size bytes of the chosen image, None if it does not answer
+        # the reply reads blank until the CRC is computed
+        (res, reply) = yield self._command_steps(self.bootloader_addr, [0x22], 4, wait_seconds * 1000,
+                                                 accept=lambda data_in: data_in not in ([0x00] * 4, [0xFF] * 4),
+                                                 cmd=0x22)
+        if res != 0:
+            raise TransientBusError("ERROR: read flash CRC error.")
+        if reply is not None:
+            yield StepResult(struct.unpack('>I', bytes(bytearray(reply)))[0])
 
     def jump_to_image(self):
         # jump to image1
-        data_out = [0x30]
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
+        return self._run(self.__leave_bootloader([0x30]))
 
     def reset(self):
-        data_out = [0x32]
-        self.i2c_dongle.write(self.bootloader_addr, None, data_out)
-
-    @retry(tries=3, delay=2)
-    def _internal_begin(self):
-        self.calc_file_size_crc()
-
-        self.choose_image_to_upgrade()
-        self.flash_addr()
-
-        self.send_total_file_size()
-        self.send_file_crc32()
-
-        print("> Backup data...")
-        self.backup_data()
-        print("> Backup data completed.")
+        return self._run(self.__leave_bootloader([0x32]))
 
-        print("> Erasing flash...")
-        self.erase_flash()
-        print("> Erase completed.")
+    def __leave_bootloader(self, data_out):
+        yield Transaction().write(self.bootloader_addr, None, data_out)
+        self.identity_cache.invalidate(self.i2c_dongle)
 
-        print("> Sending data... (%d bytes)" % self.file_size)
-        self.send_file_data()
-        print("\n> Send data completed.")
-
-        print("> Validating...")
-        self.validate_crc32()
-        print("> Validate successfully.")
+    def _internal_begin(self):
+        return self._run(self._internal_begin_steps())
+
+    def _recover_session_steps(self):
+        # the flash keeps the acked blocks, a resume falls back to a full erase if the bootloader refuses them
+        self._log("> Bootloader session lost, unlocking again...")
+        self.identity_cache.invalidate(self.i2c_dongle)
+        with self.metrics.phase('unlock'):
+            yield self._unlock_bootloader_steps()
+
+    def _internal_begin_steps(self):
+        # retried according to self.retry_policy, counting the attempts of each failure class separately
+        # a resumed attempt that got further than the last one starts a fresh budget
+        attempts = {}
+        lost = False
+        acked = self.last_acked_block
+        while True:
+            try:
+                if lost:
+                    yield self._recover_session_steps()
+                    lost = False
+                yield self._internal_begin_once()
+                break
+            except Exception as e:
+                failure_class = self.retry_policy.classify(e, self.bus_errors)
+                lost = lost or failure_class == 'lost'
+                if self.resume and self.last_acked_block > acked:
+                    (attempts, acked) = ({}, self.last_acked_block)
+                attempts[failure_class] = attempts.get(failure_class, 0) + 1
+                delay = self.retry_policy.delay(failure_class, attempts[failure_class]) if self.retry else None
+                if delay is None:
+                    raise
+                self._log("%s, Retrying in %d ms (%s)..." % (str(e).strip(), delay * 1000, failure_class))
+            yield delay
+
+    def _hook_steps(self, name):
+        # a blocking override (the hook contract before steps) has already done its work when it returns
+        owner = next(klass for klass in type(self).__mro__ if name in vars(klass))
+        if owner is not FirmwareUpgradeBase:
+            result = getattr(self, name)()
+            if isinstance(result, types.GeneratorType):
+                yield result
+            elif result is not None:
+                raise UpgradeError('ERROR: %s() of %s returned %r, override _%s_steps instead.' %
+                                   (name, type(self).__name__, result, name))
+            return
+
+        steps = getattr(self, '_%s_steps' % name)()
+        if not isinstance(steps, types.GeneratorType):
+            raise UpgradeError('ERROR: _%s_steps() of %s returned %r, not upgrade steps.' %
+                               (name, type(self).__name__, steps))
+        yield steps
+
+    def _internal_begin_once(self):
+        metrics = self.metrics
+        with metrics.phase('choose_image'):
+            yield self._choose_image_to_upgrade_steps()
+        with metrics.phase('flash_addr'):
+            yield self._flash_addr_steps()
+
+        with metrics.phase('size_crc'):
+            yield self._send_total_file_size_steps()
+            yield self._send_file_crc32_steps()
+
+        start_block = self._resume_block()
+        if not start_block and not self.force:
+            with metrics.phase('check_current'):
+                self.skipped = (yield self._read_flash_crc32_steps()) == self.file_crc32
+            self._log("> Flash CRC32 checked in %.1f ms" % (metrics.phases['check_current'] * 1000))
+            if self.skipped:
+                self._log("> Image already installed (CRC32 %08X), transfer skipped." % self.file_crc32)
+                return
+
+        if start_block:
+            self._log("> Resuming from block %d..." % (start_block + 1))
+        else:
+            self.__open_journal()
+            self._log("> Backup data...")
+            with metrics.phase('backup'):
+                yield self._hook_steps('backup_data')
+            self._log("> Backup data completed.")
+
+            self._log("> Erasing flash...")
+            with metrics.phase('erase'):
+                yield self._hook_steps('erase_flash')
+            self._log("> Erase completed.")
+
+        self._log("> Sending data... (%d bytes)" % self.file_size)
+        try:
+            with metrics.phase('send'):
+                yield self._send_file_data_steps(start_block)
+        except Exception:
+            # the bootloader refused even the first resumed block, its state is lost
+            if start_block and self.last_acked_block == start_block:
+                self._forget_checkpoint()
+            raise
+        self._log("\n> Send data completed.")
+
+        self._log("> Validating...")
+        try:
+            with metrics.phase('validate'):
+                yield self._hook_steps('validate_crc32')
+        finally:
+            self._forget_checkpoint()
+        self._log("> Validate successfully.")
 
     def begin(self):
-        startTime = datetime.now()
+        return self._run(self._begin_steps())
 
-        print("Verifying file...")
-        self.verify_file_content()
-        print("Verify file completed.")
-
-        print("Begin to upgrade...")
-        self.unlock_bootloader()
+    def _begin_steps(self):
+        startTime = datetime.now()
+        metrics = self.metrics
+        metrics.info['file'] = self.file_name
+        metrics.info['start'] = startTime.isoformat()
+        metrics.info['result'] = 'FAIL'
 
         try:
-            if self.retry:
-                self._internal_begin()
-            else:
-                _internal_begin = self._internal_begin.func_closure[3].cell_contents
-                _internal_begin(self)
-        except Exception as e:
-            self.reset()
-            raise e
-
-        self.jump_to_image()
-        print("\nUPGRADE FINISHED! [Time Elapse: %s]" %
-              str(datetime.now() - startTime).split('.')[0])
+            self._log("Verifying file...")
+            with metrics.phase('verify'):
+                yield self._verify_file_content_steps()
+            self._log("Verify file completed.")
+            metrics.info['module_number'] = self.module_number
+            metrics.info['file_size'] = self.file_size
+            metrics.info['block_size'] = self.buffer_size
+
+            self._log("Begin to upgrade...")
+            with metrics.phase('unlock'):
+                yield self._unlock_bootloader_steps()
+
+            try:
+                yield self._internal_begin_steps()
+            except Exception as e:
+                yield self.__leave_bootloader([0x32])
+                raise e
+
+            with metrics.phase('jump'):
+                yield self.__leave_bootloader([0x30])
+            metrics.info['result'] = 'SKIPPED' if self.skipped else 'OK'
+        finally:
+            metrics.info['total_s'] = (datetime.now() - startTime).total_seconds()
+            if self.metrics_path:
+                metrics.dump(self.metrics_path)
+
+        self._log("\nUPGRADE %s! [Time Elapse: %s]" %
+                  ('SKIPPED' if self.skipped else 'FINISHED', str(datetime.now() - startTime).split('.')[0]))
 
     def end(self):
-        # Close the device
+        self.close_frames()
+
+        # Close the device, whatever is attached next may be another module
+        self.identity_cache.invalidate(self.i2c_dongle)
         self.i2c_dongle.close_device()
 
 
@@ -383,7 +1005,7 @@ class VendorInfo(object):
         self.firmware_version = firmware_version
         self.firmware_type = firmware_type
         self.offset_addr = offset_addr
-        self.firmware_type_name = filter(lambda x: x in set(string.printable), firmware_type_name).upper()
-        self.module_number = filter(lambda x: x in set(string.printable), module_number).upper()
+        self.firmware_type_name = printable(firmware_type_name)
+        self.module_number = printable(module_number)
 
         return self
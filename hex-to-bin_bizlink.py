@@ -2,13 +2,26 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import re
+import json
+import time
+import array
 import struct
 import argparse
 import binascii
+import multiprocessing
 
 from intelhex import hex2bin
 
+from frame_stream import write_frame_stream
+
+# characters of a DSP .txt image, or bytes of a DSP .bin image, processed at a time
+DSP_READ_CHUNK = 1 << 20
+WORD_TYPECODE = 'I' if array.array('I').itemsize == 4 else 'L'
+
 class VendorInfo(object):
+    SIZE = 112
     IMAGE_SECTION_MAP = {
         'READ': 0x01,
         'APP': 0x81,
@@ -32,41 +45,84 @@ class VendorInfo(object):
                       struct.pack('>I', int(firmware_version[:2]) << 24 | int(firmware_version[2:4]) << 16 |
                                         int(build_version[:2]) << 8 | int(build_version[2:4])) + \
                       struct.pack('B', VendorInfo.IMAGE_SECTION_MAP[firmware_type])
-        vendor_info += struct.pack('B', 0x00) * (112 - len(vendor_info))
+        vendor_info += struct.pack('B', 0x00) * (VendorInfo.SIZE - len(vendor_info))
         return vendor_info
 
+class ImageWriter(object):
+    """Output of a .bin image, written in a single pass.
+
+    The vendor info header space is reserved up front; the payload then
+    streams through write(), which keeps its size and CRC32, and
+    append_vendor_info() patches the header in place at the end.
+    """
+
+    def __init__(self, fout):
+        self.fout = fout
+        self.size = 0
+        self.crc32 = 0
+        fout.write(struct.pack('B', 0x00) * VendorInfo.SIZE)
+
+    def write(self, data):
+        self.fout.write(data)
+        self.size += len(data)
+        self.crc32 = binascii.crc32(data, self.crc32)
+
 def convert_file_format(filename, firmware_version='0100', build_version='6789', firmware_type='APP',
-                        module_number='', vendor_pn='', start=None, end=None, size=None):
-    """convert hexadecimal format to binary format"""
+                        module_number='', vendor_pn='', start=None, end=None, size=None, frames=False,
+                        block_size=256, output=None):
+    """convert hexadecimal format to binary format, into output (<file>_<TYPE>.bin by default)"""
     (fname, ext) = os.path.splitext(filename)
-    bin_file = fname + "_" + firmware_type + ".bin"
+    bin_file = output or fname + "_" + firmware_type + ".bin"
     with open(filename, 'rb' if ext == '.bin' else 'rt') as fin, open(bin_file, 'wb') as fout:
+        image = ImageWriter(fout)
         if firmware_type.upper().startswith('DSP'):
             if ext == '.txt':
-                convert_dsp_file_format(fin, fout)
+                convert_dsp_file_format(fin, image)
             elif ext == '.bin':
-                convert_binary_dsp_file(fin, fout)
+                convert_binary_dsp_file(fin, image)
         else:
             # hex2bin(fin, fout, start, end, size, pad=0xFF)
-            hex2bin(fin, fout, start, end, size, pad=0x00)  # Change from 0xFF to 0x00 same as bootloader GUI, Lance 07/25/22.
-    append_vendor_info(bin_file, firmware_version, build_version, firmware_type, start, module_number, vendor_pn)
+            hex2bin(fin, image, start, end, size, pad=0x00)  # Change from 0xFF to 0x00 same as bootloader GUI, Lance 07/25/22.
+        crc32_value = append_vendor_info(image, firmware_version, build_version, firmware_type, start,
+                                         module_number, vendor_pn)
+
+    if frames:
+        # pre-framed companion which the upgrade tool streams without any per-run preprocessing
+        with open(bin_file, 'rb') as fin:
+            fin.seek(VendorInfo.SIZE)
+            write_frame_stream(os.path.splitext(bin_file)[0] + ".frames", fin.read(),
+                               VendorInfo.IMAGE_SECTION_MAP[firmware_type], firmware_type, start, module_number,
+                               block_size)
+
+    return (bin_file, image.size, crc32_value)
 
 def convert_dsp_file_format(fin, fout):
-    result = ''
+    """convert a DSP .txt image, one big-endian 32-bit hex word per line, to little-endian words
+
+    The text is read DSP_READ_CHUNK characters at a time; the words of a chunk are hex decoded in one
+    go and byte swapped as a whole array, so memory stays constant for any image size.
+    """
     total_bytes = 0
-    for hexstr in fin.readlines():
-        hexstr = hexstr.strip()
+    tail = ''
+    while True:
+        chunk = fin.read(DSP_READ_CHUNK)
+        text = tail + chunk
+        if chunk:
+            # an incomplete last line waits for the next chunk
+            (text, _, tail) = text.rpartition('\n')
 
-        if '//' in hexstr:
-            continue
+        words = [w for w in (line.strip()[:8] for line in text.split('\n') if '//' not in line) if w]
+        hexstr = ''.join(words)
+        if len(hexstr) != 8 * len(words):
+            raise Exception('ERROR: DSP image lines must hold 8 hex digits.')
 
-        for h in range(0, 4):
-            b = int(hexstr[6 - h * 2:6 - h * 2 + 2], 16)
-            # b = int(hexstr[h*2:h*2+2], 16)
-            result += struct.pack('B', b)
-        fout.write(result)
-        total_bytes += len(result)
-        result = ''
+        data = array.array(WORD_TYPECODE, binascii.unhexlify(hexstr))
+        data.byteswap()
+        fout.write(data.tobytes() if hasattr(data, 'tobytes') else data.tostring())
+        total_bytes += len(hexstr) // 2
+
+        if not chunk:
+            break
 
     # try to pad 0xFF
     padding = 256 - total_bytes % 256
@@ -74,65 +130,191 @@ def convert_dsp_file_format(fin, fout):
         fout.write(struct.pack('B', 0xFF) * padding)
 
 def convert_binary_dsp_file(fin, fout):
-    origin = fin.read()
-    total_bytes = len(origin)
-    fout.write(origin)
+    total_bytes = 0
+    while True:
+        block = fin.read(DSP_READ_CHUNK)
+        if not block:
+            break
+        fout.write(block)
+        total_bytes += len(block)
 
     # try to pad 0xFF
     padding = 256 - total_bytes % 256
     if 0 < padding < 256:
         fout.write(struct.pack('B', 0xFF) * padding)
 
-def append_vendor_info(target_file, firmware_version, build_version, type, offset, module_number, vendor_pn):
+def append_vendor_info(image, firmware_version, build_version, type, offset, module_number, vendor_pn):
+    """patch the vendor info into the header space the ImageWriter reserved"""
     crc32_value = 0x00000000
     if not offset: offset = 0
 
-    with open(target_file, 'rb+') as fout:
-        data = fout.read()
+    vendor_info = VendorInfo()
+    # binascii.crc32 Final Xor Value = 0xFFFFFFFF
+    # crc32_value = (image.crc32 & 0xFFFFFFFF)
+    # Change Final Xor Value to 0x00000000 match 400G DR4 Bizlink module
+    crc32_value = (image.crc32 & 0xFFFFFFFF) ^ 0xFFFFFFFF
+    image.fout.seek(0)
+    image.fout.write(vendor_info.pack(image.size, crc32_value, firmware_version,
+                                      build_version, type, offset, module_number, vendor_pn))
+    image.fout.seek(0, os.SEEK_END)
+    return crc32_value
+
+def parse_range(text):
+    """(start, end) of a "START:END" hex address range, either side may be left out"""
+    start = None
+    end = None
+    if text:
+        l = text.split(":")
+        if l[0] != '':
+            start = int(l[0], 16)
+        if l[1] != '':
+            end = int(l[1], 16)
+    return (start, end)
+
+def load_batch_manifest(path, defaults):
+    """conversion entries of a batch manifest
+
+    The manifest is a JSON file such as
+        {"images": [{"file": "app.hex", "type": "APP", "firmware_version": "0102", "build_version": "0304",
+                     "module_number": "M1", "vendor_pn": "PN1", "range": "4000:", "size": 65536,
+                     "output": "out/app_M1.bin"}, ...]}
+    with paths relative to the manifest.  Keys an entry leaves out take their value from defaults; the
+    output defaults to <file>_<TYPE>_<module number>.bin, so one source converted for several modules
+    gets one image per module.  Entries writing the same output, or over an input, are rejected before
+    any conversion starts.
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for n, image in enumerate(manifest.get('images', [])):
+        entry = dict(defaults)
+        entry.update((k, v) for k, v in image.items() if v is not None)
+        missing = [k for k in ('file', 'type', 'firmware_version', 'build_version', 'module_number', 'vendor_pn')
+                   if entry.get(k) is None]
+        if missing:
+            raise Exception('ERROR: batch entry %d has no %s.' % (n + 1, ', '.join(missing)))
+        entry['type'] = entry['type'].upper()
+        if entry['type'] not in VendorInfo.IMAGE_SECTION_MAP:
+            raise Exception('ERROR: batch entry %d has unknown type %s.' % (n + 1, entry['type']))
+        entry['file'] = os.path.join(root, entry['file'])
+        if entry.get('output'):
+            entry['output'] = os.path.join(root, entry['output'])
+        else:
+            entry['output'] = '%s_%s_%s.bin' % (os.path.splitext(entry['file'])[0], entry['type'],
+                                                re.sub(r'\W', '_', str(entry['module_number'])))
+        entries.append(entry)
+    if not entries:
+        raise Exception('ERROR: batch manifest %s lists no images.' % path)
+
+    def key(p):
+        return os.path.normcase(os.path.abspath(p))
+
+    inputs = set(key(entry['file']) for entry in entries)
+    outputs = {}
+    for n, entry in enumerate(entries):
+        for output in [entry['output']] + ([os.path.splitext(entry['output'])[0] + '.frames']
+                                           if entry.get('frames') else []):
+            if key(output) in outputs:
+                raise Exception('ERROR: batch entries %d and %d both write %s.' % (outputs[key(output)], n + 1, output))
+            if key(output) in inputs:
+                raise Exception('ERROR: batch entry %d writes over the input %s.' % (n + 1, output))
+            outputs[key(output)] = n + 1
+    return entries
+
+def convert_entry(entry):
+    """convert one batch entry in a pool worker, a failure is returned rather than raised"""
+    start_time = time.time()
+    try:
+        (start, end) = parse_range(entry.get('range'))
+        size = int(entry['size']) if entry.get('size') else None
+        (bin_file, file_size, crc32_value) = convert_file_format(
+            entry['file'], str(entry['firmware_version']), str(entry['build_version']), str(entry['type']),
+            str(entry['module_number']), str(entry['vendor_pn']), start, end, size, entry.get('frames', False),
+            entry.get('block_size', 256), entry.get('output'))
+        return (entry['file'], entry['type'], bin_file, file_size, crc32_value, time.time() - start_time, '')
+    except Exception as ex:
+        return (entry['file'], entry['type'], None, 0, None, time.time() - start_time, str(ex))
+
+def convert_batch(entries, jobs=None):
+    """convert all entries on a pool of jobs processes (one per CPU by default), results in entry order"""
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(convert_entry, entries, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
 
-        vendor_info = VendorInfo()
-        fout.seek(0)
-        # binascii.crc32 Final Xor Value = 0xFFFFFFFF
-        # crc32_value = (binascii.crc32(data) & 0xFFFFFFFF)
-        # Change Final Xor Value to 0x00000000 match 400G DR4 Bizlink module
-        crc32_value = (binascii.crc32(data) & 0xFFFFFFFF) ^ 0xFFFFFFFF
-        fout.write(vendor_info.pack(len(data), crc32_value, firmware_version,
-                                    build_version, type, offset, module_number, vendor_pn))
-        fout.write(data)
+def print_batch_summary(results, wall_time):
+    print('%-32s %-14s %-32s %8s %10s %8s  %s' % ('FILE', 'TYPE', 'OUTPUT', 'SIZE', 'CRC32', 'TIME(s)', 'ERROR'))
+    for (filename, firmware_type, bin_file, file_size, crc32_value, elapsed, error) in results:
+        print('%-32s %-14s %-32s %8d %10s %8.2f  %s' % (os.path.basename(filename), firmware_type,
+                                                       os.path.basename(bin_file) if bin_file else '-', file_size,
+                                                       '0x%08X' % crc32_value if crc32_value is not None else '-',
+                                                       elapsed, error))
+    converted = len([r for r in results if not r[6]])
+    print('\n%d/%d images converted. [Wall Time: %.1f s]' % (converted, len(results), wall_time))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='Convert hex file format to bin file format')
 
     parser.add_argument('file',
-                        help='the hex file to be converted')
+                        help='the hex file to be converted, or the JSON manifest with --batch')
     parser.add_argument('-v', '--firmware-version', dest='firmware_version',
-                        help='firmware version. e.g. 1005=v10.05', required=True)
+                        help='firmware version. e.g. 1005=v10.05')
     parser.add_argument('-b', '--builde-version', dest='build_version',
-                        help='build version. e.g. 1005=v10.05', required=True)
+                        help='build version. e.g. 1005=v10.05')
     parser.add_argument('-t', '--type', dest='firmware_type',
                         choices=('APP', 'TABLE_CMIS', 'TABLE_INTERNAL', 'DSP', 'BOOTLOADER', 'READ'),
-                        help='which firmware type to be upgraded.', required=True)
+                        help='which firmware type to be upgraded.')
     parser.add_argument('-r', '--range', dest='range',
                         help='specify address range for writing output(hex value)\nRange can be in form "START:" or ":END".')
-    parser.add_argument('-m', '--moudle-number', dest='module_number', help='module number', required=True)
-    parser.add_argument('-n', '--vendor-pn', dest='vendor_pn', help='vendor pn', required=True)
+    parser.add_argument('-m', '--moudle-number', dest='module_number', help='module number')
+    parser.add_argument('-n', '--vendor-pn', dest='vendor_pn', help='vendor pn')
     parser.add_argument('-s', '--size', dest='size',
                         help='size of output (decimal value).')
+    parser.add_argument('-f', '--frames', dest='frames', action='store_true',
+                        help='also emit a pre-framed .frames file for the upgrade tool.')
+    parser.add_argument('-B', '--block-size', dest='block_size', type=int, default=256,
+                        help='payload bytes per frame in the .frames file (decimal value).')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='the converted image, <file>_<TYPE>.bin by default.')
+    parser.add_argument('--batch', dest='batch', action='store_true',
+                        help='file is a JSON manifest of images to convert in parallel, options given here are '
+                             'the defaults of its entries.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        help='worker processes of a batch conversion, one per CPU by default.')
 
     args = parser.parse_args()
 
-    start = None
-    end = None
+    if args.batch:
+        try:
+            entries = load_batch_manifest(args.file, {
+                'type': args.firmware_type, 'firmware_version': args.firmware_version,
+                'build_version': args.build_version, 'module_number': args.module_number,
+                'vendor_pn': args.vendor_pn, 'range': args.range, 'size': args.size, 'frames': args.frames,
+                'block_size': args.block_size})
+        except Exception as ex:
+            print(ex)
+            sys.exit(1)
+        start_time = time.time()
+        results = convert_batch(entries, args.jobs)
+        print_batch_summary(results, time.time() - start_time)
+        sys.exit(0 if all(not r[6] for r in results) else 1)
+
+    missing = [option for option, value in (('-v', args.firmware_version), ('-b', args.build_version),
+                                            ('-t', args.firmware_type), ('-m', args.module_number),
+                                            ('-n', args.vendor_pn)) if value is None]
+    if missing:
+        parser.error('the following arguments are required: %s' % ', '.join(missing))
+
+    (start, end) = parse_range(args.range)
     size = None
-    if args.range:
-        l = args.range.split(":")
-        if l[0] != '':
-            start = int(l[0], 16)
-        if l[1] != '':
-            end = int(l[1], 16)
     if args.size:
         size = int(args.size, 10)
 
     convert_file_format(args.file, args.firmware_version, args.build_version,
-                        args.firmware_type, args.module_number, args.vendor_pn, start, end, size)
+                        args.firmware_type, args.module_number, args.vendor_pn, start, end, size,
+                        args.frames, args.block_size, args.output)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import importlib
+from collections import OrderedDict
+
+from Interface.capabilities import CP2112, USB_ISS
+
+# setup.py / pyproject entry points of this group add backends, e.g.
+#   [options.entry_points]
+#   i2c_dongles =
+#       FT4222 = my_dongles.ft4222:FT4222_Dongle
+ENTRY_POINT_GROUP = 'i2c_dongles'
+
+# built-in backends as 'module:class', imported only when selected
+DONGLE_BACKENDS = OrderedDict([
+    ('CP2112', 'i2c_dongle:CP2112_Dongle'),
+    ('ISS', 'i2c_dongle:ISS_Dongle'),
+])
+
+# capabilities of the built-in backends, known without importing them
+DONGLE_CAPABILITIES = {
+    'CP2112': CP2112,
+    'ISS': USB_ISS,
+}
+
+
+class CP2112_Dongle(object):
+    """Silicon Labs CP2112 HID-to-SMBus bridge, port is the device index."""
+
+    capabilities = CP2112
+
+    def __init__(self, port=0, speed=400):
+        self.index = int(port or 0)
+        self.speed = speed
+        self.smbus = None
+        self.smb = None
+
+    @property
+    def bus_errors(self):
+        return (self.smbus.HidSmbusError,) if self.smbus else ()
+
+    def open_device(self):
+        # binds SLABHIDtoSMBus only now
+        from Interface import SLABHIDtoSMBUS
+        self.smbus = SLABHIDtoSMBUS
+        self.smb = SLABHIDtoSMBUS.HidSmbusDevice()
+        self.smb.Open(self.index)
+        # read data is reported without ForceReadResponse, 100 ms write/read timeouts
+        self.smb.SetSmbusConfig(self.speed * 1000, 0x02, True, 100, 100, False, 0)
+
+    def close_device(self):
+        if self.smb:
+            self.smb.Close()
+            self.smb = None
+
+    def __wait_transfer(self):
+        while True:
+            self.smb.TransferStatusRequest()
+            status = self.smb.GetTransferStatusResponse()[0]
+            if status != self.smbus.HID_SMBUS_S0.BUSY:
+                return status
+
+    def write(self, addr, reg, data):
+        buf = bytearray(([] if reg is None else [reg]) + list(bytearray(data)))
+        try:
+            self.smb.WriteRequest(addr, buf, len(buf))
+            return 0 if self.__wait_transfer() == self.smbus.HID_SMBUS_S0.COMPLETE else 1
+        except self.smbus.HidSmbusError:
+            return 1
+
+    def read(self, addr, reg, count, cmd=None):
+        try:
+            if reg is None:
+                self.smb.ReadRequest(addr, count)
+            else:
+                self.smb.AddressReadRequest(addr, count, 1, bytearray([reg]))
+            data = bytearray()
+            while len(data) < count:
+                chunk = self.smb.GetReadResponse(count)
+                if not chunk:
+                    break
+                data += bytearray(chunk)
+        except self.smbus.HidSmbusError:
+            return (0, [])
+        return (len(data[:count]), list(data[:count]))
+
+
+class ISS_Dongle(object):
+    """Devantech USB-ISS, port is its serial port (e.g. COM3 or /dev/ttyACM0)."""
+
+    capabilities = USB_ISS
+
+    def __init__(self, port, speed=400):
+        self.port = port
+        self.speed = speed
+        self.iss = None
+
+    def open_device(self):
+        # imports usb_iss only now
+        from usb_iss import UsbIss
+        self.iss = UsbIss()
+        self.iss.open(self.port)
+        self.iss.setup_i2c(self.speed)
+
+    def close_device(self):
+        if self.iss:
+            self.iss.close()
+            self.iss = None
+
+    def write(self, addr, reg, data):
+        try:
+            if reg is None:
+                self.iss.i2c.write_ad0(addr >> 1, list(bytearray(data)))
+            else:
+                self.iss.i2c.write(addr >> 1, reg, list(bytearray(data)))
+        except Exception:
+            return 1
+        return 0
+
+    def read(self, addr, reg, count, cmd=None):
+        try:
+            if reg is None:
+                data = self.iss.i2c.read_ad0(addr >> 1, count)
+            else:
+                data = self.iss.i2c.read(addr >> 1, reg, count)
+        except Exception:
+            return (0, [])
+        return (len(data), list(data))
+
+
+def _entry_points():
+    # only reads package metadata, nothing is imported
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, []))
+
+
+class I2C_Dongle_Factory(object):
+    """Registry of dongle backends, looked up by name.
+
+    Names come from DONGLE_BACKENDS, register() and the i2c_dongles entry
+    points of installed packages.  Reading the package metadata for the
+    entry points is the slow part of a lookup, so it only happens for a
+    name that is not a built-in or registered backend, or when
+    get_dongles(installed=True) asks for all of them.  A backend module,
+    and the native library behind it, is imported only by
+    create_dongle_object() for the dongle actually selected.
+
+    get_dongles(frame_size) leaves out the backends whose capabilities are
+    known to be too small to write such a frame in one I2C transaction,
+    e.g. the CP2112 and the USB-ISS for the 260 byte frames of an upgrade.
+    """
+
+    backends = OrderedDict(DONGLE_BACKENDS)
+    installed = None
+
+    @classmethod
+    def __installed(cls):
+        if cls.installed is None:
+            cls.installed = OrderedDict((ep.name, ep) for ep in _entry_points())
+        return cls.installed
+
+    @classmethod
+    def __backends(cls, installed=False):
+        if not installed:
+            return cls.backends
+        backends = OrderedDict(cls.backends)
+        for name, ep in cls.__installed().items():
+            backends.setdefault(name, ep)
+        return backends
+
+    @classmethod
+    def register(cls, name, target):
+        """add a backend, target is a class or a 'module:class' string"""
+        cls.backends[name] = target
+
+    @classmethod
+    def get_dongles(cls, frame_size=None, installed=False):
+        return [name for name, target in cls.__backends(installed).items()
+                if frame_size is None or cls.__fits(name, target, frame_size)]
+
+    @classmethod
+    def dongle_help(cls, frame_size=None):
+        """help of a --dongle option, names the built-in and registered backends only"""
+        names = cls.get_dongles(frame_size)
+        return 'the usage of communication interface, an installed %s backend%s.' % \
+            (ENTRY_POINT_GROUP, ' or one of ' + ', '.join(names) if names else '')
+
+    @staticmethod
+    def __fits(name, target, frame_size):
+        # backends not loaded yet publish nothing, they are checked once the upgrade opens them
+        if target is DONGLE_BACKENDS.get(name):
+            capabilities = DONGLE_CAPABILITIES.get(name)
+        else:
+            capabilities = getattr(target, 'capabilities', None)
+        return capabilities is None or capabilities.max_write is None or capabilities.max_write >= frame_size
+
+    @classmethod
+    def create_dongle_object(cls, name):
+        target = cls.backends.get(name) or cls.__installed().get(name)
+        if target is None:
+            raise Exception('unknown dongle %s, choose from %s' % (name, ', '.join(cls.get_dongles(installed=True))))
+        if hasattr(target, 'load'):
+            return target.load()
+        if isinstance(target, str):
+            (module, attr) = target.split(':')
+            return getattr(importlib.import_module(module), attr)
+        return target
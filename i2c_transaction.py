@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import time
+
+WRITE = 'write'
+READ = 'read'
+DELAY = 'delay'
+
+
+def execute_sequential(dongle, ops):
+    """run ops one call at a time, for dongles without transact()"""
+    results = []
+    for op in ops:
+        if op[0] == WRITE:
+            results.append(dongle.write(op[1], op[2], op[3]))
+        elif op[0] == READ:
+            results.append(dongle.read(op[1], op[2], op[3], **op[4]))
+        else:
+            time.sleep(op[1] / 1000)
+            results.append(None)
+    return results
+
+
+class Transaction(object):
+    """A batch of I2C operations sent to a dongle in as few round-trips as it allows.
+
+    Operations are queued with write(), read() and delay() (all chainable)
+    and run in order by execute(), which returns one result per operation:
+    the write result code, the (count, data) of a read, None for a delay.
+    A dongle providing transact(ops) runs the whole batch itself (e.g. a
+    write followed by a repeated-start read in one USB transfer); any other
+    dongle gets the operations one call at a time.
+    """
+
+    def __init__(self):
+        self.ops = []
+
+    def write(self, addr, reg, data):
+        self.ops.append((WRITE, addr, reg, data))
+        return self
+
+    def read(self, addr, reg, count, **kwargs):
+        self.ops.append((READ, addr, reg, count, kwargs))
+        return self
+
+    def delay(self, milliseconds):
+        self.ops.append((DELAY, milliseconds))
+        return self
+
+    def execute(self, dongle):
+        transact = getattr(dongle, 'transact', None)
+        if transact is not None:
+            return transact(self.ops)
+        return execute_sequential(dongle, self.ops)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import re
+import sys
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import binascii
+import multiprocessing
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from i2c_dongle import I2C_Dongle_Factory
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+from section_fw_upgrade import APP_FirmwareUpgrade, TABLE_CMIS_FirmwareUpgrade, TABLE_INTERNAL_FirmwareUpgrade
+from fw_library import FirmwareLibrary
+from fw_upgrade import VendorInfo, UpgradeError, upgrade_journal_path
+from frame_stream import write_frame_stream
+
+UPGRADE_CLASSES = {
+    'APP': APP_FirmwareUpgrade,
+    'TABLE_CMIS': TABLE_CMIS_FirmwareUpgrade,
+    'TABLE_INTERNAL': TABLE_INTERNAL_FirmwareUpgrade,
+    'DSP': DSP_FirmwareUpgrade
+}
+
+
+class UpgradeSession(object):
+    """One upgrade of one module, driven through its own dongle."""
+
+    def __init__(self, port, dongle, upgrade_class, filename, password, resume=False,
+                 skip_erased=False, library=None, firmware_type_name=None, block_size=None,
+                 metrics_dir=None, image=None, force=False):
+        self.port = port
+        self.dongle = dongle
+        self.upgrade_class = upgrade_class
+        self.file_name = filename
+        self.password = password
+        self.resume = resume
+        self.skip_erased = skip_erased
+        self.library = library
+        self.firmware_type_name = firmware_type_name
+        self.block_size = block_size
+        self.metrics_dir = metrics_dir
+        self.image = image
+        self.force = force
+        self.status = 'PENDING'
+        self.error = ''
+        self.skipped_bytes = 0
+        self.skipped_seconds = 0
+        self.cur = 0
+        self.total = 0
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def tag(self):
+        # the port in a form usable in file names, e.g. /dev/ttyACM0 -> _dev_ttyACM0
+        return re.sub(r'\W', '_', str(self.port))
+
+    def progress(self, cur, total):
+        self.cur = cur
+        self.total = total
+
+    def run(self):
+        self.start_time = time.time()
+        self.status = 'RUNNING'
+        upgrade = None
+        try:
+            dongle = I2C_Dongle_Factory.create_dongle_object(self.dongle)(self.port)
+            metrics_path = os.path.join(self.metrics_dir, 'upgrade_%s.json' % self.tag) if self.metrics_dir else None
+            journal_path = upgrade_journal_path(self.file_name, '%s_%s' % (self.dongle, self.port))
+            upgrade = self.upgrade_class(dongle, self.image or self.file_name, self.password,
+                                         progress=self.progress, verbose=False, resume=self.resume,
+                                         journal_path=journal_path,
+                                         skip_erased=self.skip_erased, block_size=self.block_size,
+                                         metrics_path=metrics_path, force=self.force)
+            upgrade.init()
+            if self.library:
+                upgrade.select_from_library(self.library, self.firmware_type_name)
+            upgrade.begin()
+            self.status = 'SKIPPED' if upgrade.skipped else 'OK'
+        except Exception as ex:
+            self.status = 'FAIL'
+            self.error = str(ex).strip()
+        finally:
+            if upgrade:
+                (self.skipped_bytes, self.skipped_seconds) = (upgrade.skipped_bytes, upgrade.skipped_seconds)
+                try:
+                    upgrade.end()
+                except Exception:
+                    pass
+            self.end_time = time.time()
+
+
+def share_image(filename, workdir, block_size=256):
+    """frame a .bin image once into workdir, every worker process maps the same pages of it"""
+    vendor_info = VendorInfo()
+    with open(filename, 'rb') as f:
+        vendor_info.unpack(f.read(64))
+        data = f.read()
+    if len(data) != vendor_info.file_size or binascii.crc32(data) & 0xFFFFFFFF != vendor_info.file_crc32:
+        raise UpgradeError('Verify file error: invalid file selected')
+
+    path = os.path.join(workdir, os.path.splitext(os.path.basename(filename))[0] + '.frames')
+    write_frame_stream(path, data, vendor_info.firmware_type, vendor_info.firmware_type_name,
+                       vendor_info.offset_addr, vendor_info.module_number, block_size)
+    return path
+
+
+def run_session_process(index, session, channel):
+    # worker process: run one session, report progress at whole percent steps, then the result
+    def progress(cur, total):
+        if cur == total or cur * 100 // total != session.cur * 100 // (session.total or 1):
+            channel.put((index, 'progress', (cur, total)))
+        session.cur = cur
+        session.total = total
+
+    session.progress = progress
+    session.run()
+    channel.put((index, 'done', (session.status, session.error, session.start_time, session.end_time,
+                                 session.skipped_bytes, session.skipped_seconds)))
+
+
+class MultiUpgrade(object):
+    """Run one UpgradeSession per dongle concurrently.
+
+    Every session owns a daemon thread, so a session that hangs (e.g. in
+    unlock_bootloader) only ends up reported as TIMEOUT once session_timeout
+    seconds have passed and never blocks the other sessions.
+
+    With processes=True every session owns a worker process instead, so the
+    vendor DLL calls and the framing loop of one dongle no longer contend
+    for the GIL with the others; progress and results come back over a
+    queue and hung workers are terminated.
+    """
+
+    def __init__(self, sessions, session_timeout=600, refresh_interval=0.5, processes=False):
+        self.sessions = sessions
+        self.session_timeout = session_timeout
+        self.refresh_interval = refresh_interval
+        self.processes = processes
+
+    def __print_progress(self):
+        states = []
+        for s in self.sessions:
+            if s.status == 'RUNNING' and s.total:
+                states.append('%s:%3d%%' % (s.port, s.cur * 100 // s.total))
+            else:
+                states.append('%s:%s' % (s.port, s.status))
+        done = len([s for s in self.sessions if s.status not in ('PENDING', 'RUNNING')])
+        sys.stdout.write('\r[%d/%d] %s' % (done, len(self.sessions), ' '.join(states)))
+        sys.stdout.flush()
+
+    def run(self):
+        if self.processes:
+            return self.__run_processes()
+
+        start_time = time.time()
+        threads = []
+        for session in self.sessions:
+            t = threading.Thread(target=session.run, name=str(session.port))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        deadline = start_time + self.session_timeout
+        while any(t.is_alive() for t in threads) and time.time() < deadline:
+            self.__print_progress()
+            time.sleep(self.refresh_interval)
+        self.__print_progress()
+
+        for session, t in zip(self.sessions, threads):
+            if t.is_alive():
+                session.status = 'TIMEOUT'
+                session.error = 'no response within %d seconds' % self.session_timeout
+                session.end_time = time.time()
+
+        return time.time() - start_time
+
+    def __run_processes(self):
+        start_time = time.time()
+        channel = multiprocessing.Queue()
+        workers = []
+        for index, session in enumerate(self.sessions):
+            p = multiprocessing.Process(target=run_session_process, args=(index, session, channel),
+                                        name=str(session.port))
+            p.daemon = True
+            p.start()
+            session.status = 'RUNNING'
+            session.start_time = time.time()
+            workers.append(p)
+
+        pending = set(range(len(self.sessions)))
+        deadline = start_time + self.session_timeout
+        while pending and time.time() < deadline:
+            self.__print_progress()
+            refresh = time.time() + self.refresh_interval
+            while pending:
+                try:
+                    (index, kind, value) = channel.get(timeout=max(refresh - time.time(), 0))
+                except Empty:
+                    break
+                session = self.sessions[index]
+                if kind == 'progress':
+                    (session.cur, session.total) = value
+                else:
+                    (session.status, session.error, session.start_time, session.end_time,
+                     session.skipped_bytes, session.skipped_seconds) = value
+                    pending.discard(index)
+
+            # a worker exiting normally has always queued its result, only a crash loses it
+            for index in list(pending):
+                if workers[index].exitcode not in (None, 0):
+                    session = self.sessions[index]
+                    session.status = 'FAIL'
+                    session.error = 'worker process exited with code %d' % workers[index].exitcode
+                    session.end_time = time.time()
+                    pending.discard(index)
+        self.__print_progress()
+
+        for index in pending:
+            workers[index].terminate()
+            session = self.sessions[index]
+            session.status = 'TIMEOUT'
+            session.error = 'no response within %d seconds' % self.session_timeout
+            session.end_time = time.time()
+        for p in workers:
+            p.join()
+
+        return time.time() - start_time
+
+    def print_summary(self, wall_time):
+        print('\n')
+        print('%-12s %-8s %10s %10s %10s  %s' % ('PORT', 'RESULT', 'TIME(s)', 'SKIP(KB)', 'SAVED(s)', 'ERROR'))
+        for s in self.sessions:
+            print('%-12s %-8s %10.1f %10d %10.1f  %s' %
+                  (s.port, s.status, s.elapsed, s.skipped_bytes // 1024, s.skipped_seconds, s.error))
+        passed = len([s for s in self.sessions if s.status == 'OK'])
+        skipped = [s for s in self.sessions if s.status == 'SKIPPED']
+        print('\n%d/%d modules upgraded. [Wall Time: %.1f s]' % (passed, len(self.sessions), wall_time))
+        skipped_bytes = sum(s.skipped_bytes for s in self.sessions)
+        if skipped_bytes:
+            print('%d bytes of erased blocks not sent, ~%.1f s saved' %
+                  (skipped_bytes, sum(s.skipped_seconds for s in self.sessions)))
+        if skipped:
+            print('%d modules already current, not upgraded: %s' % (len(skipped), ' '.join(str(s.port) for s in skipped)))
+
+
+# ==========================================================================
+# MAIN PROGRAM
+# ==========================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Upgrade many modules concurrently, one per I2C dongle')
+
+    parser.add_argument(
+        'file',
+        help='the file to be sent, or a firmware library directory to pick it per module from'
+    )
+    parser.add_argument(
+        '-d', '--dongle',
+        dest='dongle',
+        help=I2C_Dongle_Factory.dongle_help(min(c.min_frame_size() for c in UPGRADE_CLASSES.values()))
+    )
+    parser.add_argument(
+        '-t', '--type',
+        dest='firmware_type',
+        default='DSP',
+        choices=sorted(UPGRADE_CLASSES.keys()),
+        help='which firmware type to be upgraded.'
+    )
+    parser.add_argument(
+        '-pwd', '--password',
+        dest='password',
+        default='C24F4F54',
+        type=lambda x: int(x, 16),
+        help='the password(hex string) of module bootloader protected.'
+    )
+    parser.add_argument(
+        '--ports', '-p',
+        dest='ports',
+        nargs='+',
+        required=True,
+        help='the port numbers which I2C dongle devices are attached'
+    )
+    parser.add_argument(
+        '--block-size',
+        dest='block_size',
+        type=lambda x: x if x == 'auto' else int(x),
+        help="payload bytes per data frame, or 'auto' to negotiate the largest supported size."
+    )
+    parser.add_argument(
+        '--skip-erased',
+        dest='skip_erased',
+        action='store_true',
+        help='do not send blocks consisting of 0xFF only, flash is already erased.'
+    )
+    parser.add_argument(
+        '--metrics-dir',
+        dest='metrics_dir',
+        help='write per-phase timings and block latency histogram of every session to this directory.'
+    )
+    parser.add_argument(
+        '--library-cache',
+        dest='library_cache',
+        help='the index cache of a firmware library, by default .fw_library.json in the library directory.'
+    )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help='retry failing blocks on their own and resume interrupted upgrades.'
+    )
+    parser.add_argument(
+        '--force',
+        dest='force',
+        action='store_true',
+        help='upgrade even when a module already runs this image.'
+    )
+    parser.add_argument(
+        '--processes',
+        dest='processes',
+        action='store_true',
+        help='run every session in its own worker process, the image is framed once and shared by all.'
+    )
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        default=600,
+        type=int,
+        help='seconds after which a session is reported as hung'
+    )
+
+    args = parser.parse_args()
+
+    _, ext = os.path.splitext(args.file)
+    if not os.path.isdir(args.file) and ext.lower() not in ('.bin', '.frames'):
+        print("Error: invalid file format")
+        sys.exit()
+
+    library = FirmwareLibrary(args.file, args.library_cache).scan() if os.path.isdir(args.file) else None
+    workdir = None
+    image = None
+    if args.processes and library is None and ext.lower() == '.bin':
+        workdir = tempfile.mkdtemp()
+        image = share_image(args.file, workdir, args.block_size if isinstance(args.block_size, int) else 256)
+
+    sessions = [UpgradeSession(port, args.dongle, UPGRADE_CLASSES[args.firmware_type], args.file, args.password,
+                               args.resume, args.skip_erased, library, args.firmware_type, args.block_size,
+                               args.metrics_dir, image, args.force)
+                for port in args.ports]
+    multi = MultiUpgrade(sessions, args.timeout, processes=args.processes)
+    try:
+        wall_time = multi.run()
+        multi.print_summary(wall_time)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
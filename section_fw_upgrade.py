@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from fw_upgrade import FirmwareUpgradeBase
+
+
+class SectionFirmwareUpgrade(FirmwareUpgradeBase):
+    """Upgrade of the image section whose type name the vendor info carries.
+
+    Subclasses name the section; without a backup step of their own they
+    go through the default erase and validate timeouts of the bootloader.
+    """
+
+    section = None
+
+    def verify_firmware_type(self, firmware_type_name):
+        # the vendor info keeps 12 characters of the type name
+        return self.section is not None and firmware_type_name.startswith(self.section[:12])
+
+
+class APP_FirmwareUpgrade(SectionFirmwareUpgrade):
+    section = 'APP'
+
+
+class TABLE_CMIS_FirmwareUpgrade(SectionFirmwareUpgrade):
+    section = 'TABLE_CMIS'
+
+
+class TABLE_INTERNAL_FirmwareUpgrade(SectionFirmwareUpgrade):
+    section = 'TABLE_INTERNAL'
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from bootloader_emulator import BootloaderEmulator, build_image
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+from multi_upgrade import share_image
+
+
+class FrameStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def verify(self, emulator, path):
+        upgrade = DSP_FirmwareUpgrade(emulator, path, verbose=False)
+        upgrade.init()
+        try:
+            upgrade.verify_file_content()
+            return upgrade.module_number
+        finally:
+            upgrade.end()
+
+    def test_padded_module_number_verifies_on_both_paths(self):
+        image = os.path.join(self.workdir, 'image.bin')
+        build_image(image, os.urandom(1000), module_number='PADDED  ')
+        emulator = BootloaderEmulator(module_number='PADDED  ', byte_cost_us=0, transaction_ms=0)
+
+        module_number = self.verify(emulator, image)
+        self.assertEqual(self.verify(emulator, share_image(image, self.workdir)), module_number)
+
+
+if __name__ == '__main__':
+    unittest.main()
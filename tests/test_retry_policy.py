@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from bootloader_emulator import BootloaderEmulator, build_image
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+
+# no waiting on the emulated bootloader
+LATENCY_MS = {0x10: 0, 0x20: 0, 0x22: 0, 0x44: 0}
+
+
+class LibraryError(Exception):
+    pass
+
+
+class LateBusErrorsEmulator(BootloaderEmulator):
+    """knows its bus error only once opened, like CP2112_Dongle, and fails the first data block with it"""
+
+    def __init__(self, **kwargs):
+        BootloaderEmulator.__init__(self, **kwargs)
+        self.library = None
+        self.failed = False
+
+    @property
+    def bus_errors(self):
+        return (self.library,) if self.library else ()
+
+    def open_device(self):
+        BootloaderEmulator.open_device(self)
+        self.library = LibraryError
+
+    def write(self, addr, reg, data):
+        if not self.failed and bytearray(data)[:1] == bytearray([0x21]):
+            self.failed = True
+            raise LibraryError('transfer failed')
+        return BootloaderEmulator.write(self, addr, reg, data)
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.workdir, 'image.bin')
+        build_image(self.image, os.urandom(4096))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_bus_errors_known_after_open_are_transient(self):
+        emulator = LateBusErrorsEmulator(latency_ms=LATENCY_MS, byte_cost_us=0, transaction_ms=0)
+        upgrade = DSP_FirmwareUpgrade(emulator, self.image, verbose=False, progress=lambda cur, total: None)
+        upgrade.init()
+        upgrade.begin()
+        self.assertTrue(emulator.failed)
+        self.assertEqual(upgrade.metrics.info['result'], 'OK')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from bootloader_emulator import BootloaderEmulator, build_image
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+from fw_upgrade import UpgradeError
+
+# no waiting on the emulated bootloader
+LATENCY_MS = {0x10: 0, 0x20: 0, 0x22: 0, 0x44: 0}
+
+
+class NonProgrammingEmulator(BootloaderEmulator):
+    """acknowledges every data block without writing it to flash"""
+
+    def _BootloaderEmulator__program(self, data):
+        return True
+
+
+class BlockingHooksUpgrade(DSP_FirmwareUpgrade):
+    """hook overrides written against the blocking contract"""
+
+    calls = ()
+
+    def erase_flash(self):
+        self.calls += ('erase_flash',)
+        self._internal_erase_flash(10)
+
+    def validate_crc32(self):
+        self.calls += ('validate_crc32',)
+        self._internal_validate_crc32(1)
+
+
+class NoStepsUpgrade(DSP_FirmwareUpgrade):
+    def _erase_flash_steps(self):
+        self._internal_erase_flash(10)
+
+
+class UpgradeHooksTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.workdir, 'image.bin')
+        self.payload = os.urandom(4096)
+        build_image(self.image, self.payload)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def upgrade(self, cls, emulator):
+        upgrade = cls(emulator, self.image, retry_if_error=False, verbose=False, progress=lambda cur, total: None)
+        upgrade.init()
+        return upgrade
+
+    def test_blocking_hooks_still_run(self):
+        emulator = BootloaderEmulator(latency_ms=LATENCY_MS, byte_cost_us=0, transaction_ms=0)
+        upgrade = self.upgrade(BlockingHooksUpgrade, emulator)
+        upgrade.begin()
+        self.assertEqual(upgrade.calls, ('erase_flash', 'validate_crc32'))
+        self.assertEqual(bytes(emulator.images[upgrade.image][:len(self.payload)]), self.payload)
+
+    def test_blocking_validate_catches_unprogrammed_flash(self):
+        emulator = NonProgrammingEmulator(latency_ms=LATENCY_MS, byte_cost_us=0, transaction_ms=0)
+        upgrade = self.upgrade(BlockingHooksUpgrade, emulator)
+        self.assertRaises(UpgradeError, upgrade.begin)
+        self.assertEqual(upgrade.calls, ('erase_flash', 'validate_crc32'))
+
+    def test_steps_hook_returning_nothing_fails(self):
+        emulator = BootloaderEmulator(latency_ms=LATENCY_MS, byte_cost_us=0, transaction_ms=0)
+        upgrade = self.upgrade(NoStepsUpgrade, emulator)
+        self.assertRaises(UpgradeError, upgrade.begin)
+
+    def test_verify_module_number_returns_bool(self):
+        emulator = BootloaderEmulator(latency_ms=LATENCY_MS, byte_cost_us=0, transaction_ms=0)
+        upgrade = self.upgrade(DSP_FirmwareUpgrade, emulator)
+        self.assertIs(upgrade.verify_module_number('EMULATED'), True)
+        self.assertIs(upgrade.verify_module_number('OTHER'), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from bootloader_emulator import BootloaderEmulator, build_image
+from dsp_fw_upgrade import DSP_FirmwareUpgrade
+from fw_upgrade import UpgradeJournal, upgrade_journal_path
+
+# no waiting on the emulated bootloader
+LATENCY_MS = {0x10: 0, 0x20: 0, 0x22: 0, 0x44: 0}
+
+
+class FailingJournal(UpgradeJournal):
+    """opens fine, fails every checkpoint as a full or vanished share would"""
+
+    def save(self, state):
+        raise IOError(28, 'No space left on device')
+
+
+class UpgradeJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.workdir, 'image.bin')
+        self.payload = os.urandom(4096)
+        build_image(self.image, self.payload)
+        self.emulator = BootloaderEmulator(latency_ms=LATENCY_MS, byte_cost_us=0, transaction_ms=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def upgrade(self, journal_path):
+        upgrade = DSP_FirmwareUpgrade(self.emulator, self.image, verbose=False, progress=lambda cur, total: None,
+                                      resume=True, journal_path=journal_path)
+        upgrade.init()
+        return upgrade
+
+    def assertFlashed(self, upgrade):
+        self.assertEqual(bytes(self.emulator.images[upgrade.image][:len(self.payload)]), self.payload)
+
+    def test_journal_per_port(self):
+        self.assertNotEqual(upgrade_journal_path(self.image, 'CP2112_0'), upgrade_journal_path(self.image, 'CP2112_1'))
+        self.assertNotEqual(os.path.dirname(upgrade_journal_path(self.image)), self.workdir)
+
+    def test_unwritable_journal_checked_before_erase(self):
+        # the image is a file, no directory can be made below it
+        upgrade = self.upgrade(os.path.join(self.image, 'image.journal'))
+        upgrade.begin()
+        self.assertIsNone(upgrade.journal)
+        self.assertFlashed(upgrade)
+
+    def test_failing_checkpoint_keeps_upgrading(self):
+        upgrade = self.upgrade(os.path.join(self.workdir, 'image.journal'))
+        upgrade.journal = FailingJournal(upgrade.journal.path)
+        upgrade.begin()
+        self.assertIsNone(upgrade.journal)
+        self.assertFlashed(upgrade)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, with_statement, print_function
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LatencyHistogram(object):
+    """Latency histogram with power-of-two microsecond buckets."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        bound = 1
+        while bound < us:
+            bound <<= 1
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, p):
+        # upper bound (ms) of the bucket holding the p-th percentile
+        seen = 0
+        for bound in sorted(self.buckets):
+            seen += self.buckets[bound]
+            if seen >= self.count * p / 100:
+                return bound / 1000
+        return 0
+
+    def to_dict(self):
+        return OrderedDict([
+            ('count', self.count),
+            ('mean_ms', self.total * 1000 / self.count if self.count else 0),
+            ('min_ms', (self.min or 0) * 1000),
+            ('max_ms', (self.max or 0) * 1000),
+            ('p50_ms', self.percentile(50)),
+            ('p99_ms', self.percentile(99)),
+            ('buckets_us', OrderedDict(('<=%d' % b, self.buckets[b]) for b in sorted(self.buckets)))])
+
+
+class UpgradeMetrics(object):
+    """Per-phase wall times and block write+ACK latencies of one upgrade session."""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.block_latency = LatencyHistogram()
+        self.info = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            # phases repeated by a retry add up
+            self.phases[name] = self.phases.get(name, 0) + time.time() - start
+
+    def to_dict(self):
+        return OrderedDict([
+            ('info', self.info),
+            ('phases_s', self.phases),
+            ('block_write_ack', self.block_latency.to_dict())])
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)